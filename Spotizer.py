@@ -1,10 +1,9 @@
 import sys
 import os
-from dataclasses import dataclass
+import multiprocessing
 from datetime import datetime
 from pathlib import Path
 import requests
-import re
 from packaging import version
 import qdarktheme
 
@@ -18,32 +17,23 @@ from PyQt6.QtCore import Qt, QThread, pyqtSignal, QUrl, QTimer, QTime, QSettings
 from PyQt6.QtGui import QIcon, QTextCursor, QDesktopServices, QPixmap
 from PyQt6.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
 
-from getMetadata import get_filtered_data, parse_uri, SpotifyInvalidUrlException
-from configparser import ConfigParser
-import deezer as deezer
-from deezer import init_deezer_session, get_song_infos_from_deezer_website, download_song, TYPE_TRACK
-
-@dataclass
-class Track:
-    id: str
-    title: str
-    artists: str
-    album: str
-    track_number: int
-    duration_ms: int
-    release_date: str = ""
+from getMetadata import get_filtered_data, parse_uri, SpotifyClient, SpotifyInvalidUrlException
+from downloader import Downloader, tracks_from_metadata, output_folder
+from jobstore import JobStore, FAILED
+from fleet import FleetCoordinator
 
 class MetadataFetchWorker(QThread):
     finished = pyqtSignal(dict)
     error = pyqtSignal(str)
     
-    def __init__(self, url):
+    def __init__(self, url, client=None):
         super().__init__()
         self.url = url
+        self.client = client
         
     def run(self):
         try:
-            metadata = get_filtered_data(self.url)
+            metadata = get_filtered_data(self.url, client=self.client)
             if "error" in metadata:
                 self.error.emit(metadata["error"])
             else:
@@ -57,156 +47,60 @@ class DownloadWorker(QThread):
     finished = pyqtSignal(bool, str, list)
     progress = pyqtSignal(str, int)
     
-    def __init__(self, tracks, outpath, arl, is_single_track=False, is_album=False, is_playlist=False, 
-                 album_or_playlist_name='', filename_format='title_artist', use_track_numbers=True,
-                 use_album_subfolders=False, use_artist_subfolders=False):
+    def __init__(self, *args, resume_job_id=None, **kwargs):
+        # same arguments as Downloader, which does the work in this thread
+        # with resume_job_id, the arguments of Downloader.from_store without the job id
         super().__init__()
-        self.tracks = tracks
-        self.outpath = outpath
-        self.arl = arl
-        self.is_single_track = is_single_track
-        self.is_album = is_album
-        self.is_playlist = is_playlist
-        self.album_or_playlist_name = album_or_playlist_name
-        self.filename_format = filename_format
-        self.use_track_numbers = use_track_numbers
-        self.use_album_subfolders = use_album_subfolders
-        self.use_artist_subfolders = use_artist_subfolders
-        self.is_paused = False
-        self.is_stopped = False
-        self.failed_tracks = []
-        
-        self.config = ConfigParser()
-        self.config['deezer'] = {
-            'cookie_arl': self.arl
-        }
-        deezer.config = self.config
-        init_deezer_session("")
-
-    def get_formatted_filename(self, track):
-        if self.filename_format == "artist_title":
-            filename = f"{track.artists} - {track.title}.mp3"
-        elif self.filename_format == "title_only":
-            filename = f"{track.title}.mp3"
+        if resume_job_id is not None:
+            self.downloader = Downloader.from_store(kwargs.pop('store'), resume_job_id, *args,
+                                                    on_progress=self.progress.emit, **kwargs)
         else:
-            filename = f"{track.title} - {track.artists}.mp3"
-        filename = re.sub(r'[<>:"/\\|?*]', lambda m: "'" if m.group() == '"' else '_', filename)
-        return filename
+            self.downloader = Downloader(*args, on_progress=self.progress.emit, **kwargs)
+
+    @property
+    def is_paused(self):
+        return self.downloader.is_paused
 
     def run(self):
-        try:
-            total_tracks = len(self.tracks)
-            
-            for i, track in enumerate(self.tracks):
-                while self.is_paused:
-                    if self.is_stopped:
-                        return
-                    self.msleep(100)
-                if self.is_stopped:
-                    return
-
-                self.progress.emit(f"Starting download ({i+1}/{total_tracks}): {track.title} - {track.artists}", 
-                                int((i) / total_tracks * 100))
-                
-                try:
-                    self.download_track(track, self.outpath)
-                    self.progress.emit(f"Successfully downloaded: {track.title} - {track.artists}", 
-                                    int((i + 1) / total_tracks * 100))
-                except Exception as e:
-                    if str(e) == "File already exists":
-                        self.progress.emit(f"Skipped (File exists): {track.title} - {track.artists}", 
-                                        int((i + 1) / total_tracks * 100))
-                    else:
-                        self.failed_tracks.append((track.title, track.artists, str(e)))
-                        self.progress.emit(f"Failed to download: {track.title} - {track.artists}\nError: {str(e)}", 
-                                        int((i + 1) / total_tracks * 100))
-                    continue
-
-            if not self.is_stopped:
-                success_message = "Download completed!"
-                if self.failed_tracks:
-                    success_message += f"\n\nFailed downloads: {len(self.failed_tracks)} tracks"
-                self.finished.emit(True, success_message, self.failed_tracks)
-                
-        except Exception as e:
-            self.finished.emit(False, str(e), self.failed_tracks)
+        result = self.downloader.run()
+        if result is not None:
+            self.finished.emit(*result)
 
-    def download_track(self, track, outpath):
-        try:
-            if self.is_playlist:
-                if self.use_artist_subfolders:
-                    artist_name = track.artists.split(', ')[0] if ', ' in track.artists else track.artists
-                    artist_folder = re.sub(r'[<>:"/\\|?*]', lambda m: "'" if m.group() == '"' else '_', artist_name)
-                    outpath = os.path.join(outpath, artist_folder)
-                
-                if self.use_album_subfolders:
-                    album_folder = re.sub(r'[<>:"/\\|?*]', lambda m: "'" if m.group() == '"' else '_', track.album)
-                    outpath = os.path.join(outpath, album_folder)
-                
-                os.makedirs(outpath, exist_ok=True)
+    def pause(self):
+        self.downloader.pause()
 
-            if (self.is_album or (self.is_playlist and (self.use_artist_subfolders or self.use_album_subfolders))) and self.use_track_numbers:
-                filename = f"{track.track_number:02d} - {self.get_formatted_filename(track)}"
-            else:
-                filename = self.get_formatted_filename(track)
-            
-            filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-            full_path = os.path.join(outpath, filename)
+    def resume(self):
+        self.downloader.resume()
 
-            if os.path.exists(full_path):
-                raise Exception("File already exists")
+    def stop(self): 
+        self.downloader.stop()
 
-            response = requests.get(f"https://api.deezer.com/2.0/track/isrc:{track.id}")
-            track_data = response.json()
-            
-            if "error" in track_data:
-                raise Exception(f"Failed to find track on Deezer")
-            
-            track_id = track_data.get("id")
-            if not track_id:
-                raise Exception("Could not find track ID on Deezer")
-            
-            song_info = get_song_infos_from_deezer_website(TYPE_TRACK, track_id)
-            if not song_info:
-                raise Exception("Could not get song information from Deezer")
-            
-            initial_files = set(os.listdir(outpath))
-            
-            download_song(song_info, os.path.join(outpath, "temp.mp3"))
-            
-            self.msleep(500)
-            
-            final_files = set(os.listdir(outpath))
-            
-            new_files = final_files - initial_files
-            if not new_files:
-                raise Exception("Could not find downloaded file")
-            
-            downloaded_file = new_files.pop()
-            
-            old_path = os.path.join(outpath, downloaded_file)
-            
-            if os.path.exists(full_path):
-                os.remove(old_path)
-            else:
-                os.rename(old_path, full_path)
-            
-        except Exception as e:
-            if str(e) == "File already exists":
-                raise
-            raise Exception(f"Download failed: {str(e)}")
+class FleetWorker(QThread):
+    """ runs a download on several worker processes, with the same signals as DownloadWorker """
+    finished = pyqtSignal(bool, str, list)
+    progress = pyqtSignal(str, int)
+
+    def __init__(self, arl, processes, max_workers):
+        super().__init__()
+        self.coordinator = FleetCoordinator(arl, processes, max_workers, on_progress=self.progress.emit)
+
+    @property
+    def is_paused(self):
+        return self.coordinator.is_paused
+
+    def run(self):
+        result = self.coordinator.run()
+        if result is not None:
+            self.finished.emit(*result)
 
     def pause(self):
-        self.is_paused = True
-        self.progress.emit("Download process paused.", 0)
+        self.coordinator.pause()
 
     def resume(self):
-        self.is_paused = False
-        self.progress.emit("Download process resumed.", 0)
+        self.coordinator.resume()
 
-    def stop(self): 
-        self.is_stopped = True
-        self.is_paused = False
+    def stop(self):
+        self.coordinator.stop()
 
 class UpdateDialog(QDialog):
     def __init__(self, current_version, new_version, parent=None):
@@ -254,6 +148,10 @@ class SpotizerGUI(QWidget):
         self.use_track_numbers = self.settings.value('use_track_numbers', False, type=bool)
         self.use_album_subfolders = self.settings.value('use_album_subfolders', False, type=bool)
         self.use_artist_subfolders = self.settings.value('use_artist_subfolders', False, type=bool)
+        self.concurrent_downloads = self.settings.value('concurrent_downloads', 4, type=int)
+        self.worker_processes = self.settings.value('worker_processes', 1, type=int)
+        self.spotify_client = SpotifyClient(pool_size=self.concurrent_downloads)
+        self.job_store = JobStore()
         self.check_for_updates = self.settings.value('check_for_updates', True, type=bool)
         self.current_theme_color = self.settings.value('theme_color', '#2196F3')
         self.track_list_format = self.settings.value('track_list_format', 'track_artist_date_duration')
@@ -267,6 +165,7 @@ class SpotizerGUI(QWidget):
         self.network_manager.finished.connect(self.on_cover_loaded)
         
         self.initUI()
+        self.log_unfinished_jobs()
         
         if self.check_for_updates:
             QTimer.singleShot(0, self.check_updates)
@@ -615,9 +514,19 @@ class SpotizerGUI(QWidget):
         self.stop_btn.clicked.connect(self.stop_download)
         self.pause_resume_btn.clicked.connect(self.toggle_pause_resume)
         
+        self.resume_jobs_btn = QPushButton('Resume Unfinished')
+        self.retry_failed_btn = QPushButton('Retry Failed')
+        for btn in (self.resume_jobs_btn, self.retry_failed_btn):
+            btn.setFixedWidth(120)
+            btn.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.resume_jobs_btn.clicked.connect(self.resume_unfinished_job)
+        self.retry_failed_btn.clicked.connect(self.retry_failed_tracks)
+        
         control_layout.addStretch()
         control_layout.addWidget(self.stop_btn)
         control_layout.addWidget(self.pause_resume_btn)
+        control_layout.addWidget(self.resume_jobs_btn)
+        control_layout.addWidget(self.retry_failed_btn)
         control_layout.addStretch()
         
         process_layout.addLayout(control_layout)
@@ -779,6 +688,28 @@ class SpotizerGUI(QWidget):
         
         checkbox_layout.addStretch()
         file_layout.addLayout(checkbox_layout)
+
+        concurrency_layout = QHBoxLayout()
+        concurrency_label = QLabel('Concurrent Downloads:')
+        
+        self.concurrent_downloads_dropdown = QComboBox()
+        for count in range(1, 11):
+            self.concurrent_downloads_dropdown.addItem(str(count), count)
+        self.concurrent_downloads_dropdown.currentIndexChanged.connect(self.save_concurrent_downloads)
+        
+        processes_label = QLabel('Worker Processes:')
+        self.worker_processes_dropdown = QComboBox()
+        for count in range(1, 9):
+            self.worker_processes_dropdown.addItem(str(count), count)
+        self.worker_processes_dropdown.currentIndexChanged.connect(self.save_worker_processes)
+        
+        concurrency_layout.addWidget(concurrency_label)
+        concurrency_layout.addWidget(self.concurrent_downloads_dropdown)
+        concurrency_layout.addSpacing(10)
+        concurrency_layout.addWidget(processes_label)
+        concurrency_layout.addWidget(self.worker_processes_dropdown)
+        concurrency_layout.addStretch()
+        file_layout.addLayout(concurrency_layout)
         
         settings_layout.addWidget(file_group)
 
@@ -795,7 +726,7 @@ class SpotizerGUI(QWidget):
         arl_label = QLabel('Deezer ARL:')
         
         self.arl_input = QLineEdit()
-        self.arl_input.setPlaceholderText("Enter Deezer ARL")
+        self.arl_input.setPlaceholderText("Enter Deezer ARL, separate several accounts with commas")
         self.arl_input.setText(self.last_arl)
         self.arl_input.textChanged.connect(self.save_arl)
         self.arl_input.setClearButtonEnabled(True)
@@ -812,6 +743,8 @@ class SpotizerGUI(QWidget):
         
         self.set_combobox_value(self.track_list_format_dropdown, self.track_list_format)
         self.set_combobox_value(self.date_format_dropdown, self.date_format)
+        self.set_combobox_value(self.concurrent_downloads_dropdown, self.concurrent_downloads)
+        self.set_combobox_value(self.worker_processes_dropdown, self.worker_processes)
         
     def setup_theme_tab(self):
         theme_tab = QWidget()
@@ -1050,6 +983,18 @@ class SpotizerGUI(QWidget):
         self.settings.setValue('use_artist_subfolders', self.use_artist_subfolders)
         self.settings.sync()
 
+    def save_concurrent_downloads(self):
+        self.concurrent_downloads = self.concurrent_downloads_dropdown.currentData()
+        self.settings.setValue('concurrent_downloads', self.concurrent_downloads)
+        self.settings.sync()
+        if self.concurrent_downloads != self.spotify_client.pool_size:
+            self.spotify_client = SpotifyClient(pool_size=self.concurrent_downloads)
+
+    def save_worker_processes(self):
+        self.worker_processes = self.worker_processes_dropdown.currentData()
+        self.settings.setValue('worker_processes', self.worker_processes)
+        self.settings.sync()
+
     def save_arl(self):
         self.settings.setValue('arl', self.arl_input.text().strip())
         self.settings.setValue('output_path', self.output_dir.text().strip())
@@ -1095,7 +1040,7 @@ class SpotizerGUI(QWidget):
             self.log_output.append('Just a moment. Fetching metadata...')
             self.tab_widget.setCurrentWidget(self.process_tab)
             
-            self.metadata_worker = MetadataFetchWorker(url)
+            self.metadata_worker = MetadataFetchWorker(url, self.spotify_client)
             self.metadata_worker.finished.connect(self.on_metadata_fetched)
             self.metadata_worker.error.connect(self.on_metadata_error)
             self.metadata_worker.start()
@@ -1127,21 +1072,10 @@ class SpotizerGUI(QWidget):
         self.log_output.append(f'Error: {error_message}')
 
     def handle_track_metadata(self, track_data):
-        track = Track(
-            id=track_data["isrc"],
-            title=track_data["name"],
-            artists=track_data["artists"],
-            album=track_data["album_name"],
-            track_number=1,
-            duration_ms=track_data.get("duration_ms", 0),
-            release_date=track_data.get("release_date", "")
-        )
-        
-        self.tracks = [track]
-        self.all_tracks = [track]
+        self.tracks, self.album_or_playlist_name, _ = tracks_from_metadata("track", {"track": track_data})
+        self.all_tracks = self.tracks.copy()
         self.is_single_track = True
         self.is_album = self.is_playlist = False
-        self.album_or_playlist_name = f"{self.tracks[0].title} - {self.tracks[0].artists}"
         
         metadata = {
             'title': track_data["name"],
@@ -1153,21 +1087,7 @@ class SpotizerGUI(QWidget):
         self.update_display_after_fetch(metadata)
 
     def handle_album_metadata(self, album_data):
-        self.album_or_playlist_name = album_data["album_info"]["name"]
-        self.tracks = []
-        
-        for track in album_data["track_list"]:
-            track_id = track.get("isrc", "")
-            self.tracks.append(Track(
-                id=track_id,
-                title=track["name"],
-                artists=track["artists"],
-                album=self.album_or_playlist_name,
-                track_number=track["track_number"],
-                duration_ms=track.get("duration_ms", 0),
-                release_date=track.get("release_date", "")
-            ))
-        
+        self.tracks, self.album_or_playlist_name, _ = tracks_from_metadata("album", album_data)
         self.all_tracks = self.tracks.copy()
         self.is_album = True
         self.is_playlist = self.is_single_track = False
@@ -1182,21 +1102,7 @@ class SpotizerGUI(QWidget):
         self.update_display_after_fetch(metadata)
 
     def handle_playlist_metadata(self, playlist_data):
-        self.album_or_playlist_name = playlist_data["playlist_info"]["owner"]["name"]
-        self.tracks = []
-        
-        for track in playlist_data["track_list"]:
-            track_id = track.get("isrc", "")
-            self.tracks.append(Track(
-                id=track_id,
-                title=track["name"],
-                artists=track["artists"],
-                album=track["album_name"],
-                track_number=len(self.tracks) + 1,
-                duration_ms=track.get("duration_ms", 0),
-                release_date=track.get("release_date", "")
-            ))
-        
+        self.tracks, self.album_or_playlist_name, _ = tracks_from_metadata("playlist", playlist_data)
         self.all_tracks = self.tracks.copy()
         self.is_playlist = True
         self.is_album = self.is_single_track = False
@@ -1212,21 +1118,7 @@ class SpotizerGUI(QWidget):
 
     def handle_discography_metadata(self, discography_data):
         artist_info = discography_data["artist_info"]
-        self.album_or_playlist_name = f"{artist_info['name']} - Discography ({artist_info['discography_type'].title()})"
-        self.tracks = []
-        
-        for track in discography_data["track_list"]:
-            track_id = track.get("isrc", "")
-            self.tracks.append(Track(
-                id=track_id,
-                title=track["name"],
-                artists=track["artists"],
-                album=track["album_name"],
-                track_number=track.get("track_number", len(self.tracks) + 1),
-                duration_ms=track.get("duration_ms", 0),
-                release_date=track.get("release_date", "")
-            ))
-        
+        self.tracks, self.album_or_playlist_name, _ = tracks_from_metadata("artist_discography", discography_data)
         self.all_tracks = self.tracks.copy()
         self.is_playlist = True
         self.is_album = self.is_single_track = False
@@ -1426,9 +1318,7 @@ class SpotizerGUI(QWidget):
         tracks_to_download = self.tracks if self.is_single_track else [self.tracks[i] for i in indices]
 
         if self.is_album or self.is_playlist:
-            folder_name = re.sub(r'[<>:"/\\|?*]', '_', self.album_or_playlist_name)
-            outpath = os.path.join(outpath, folder_name)
-            os.makedirs(outpath, exist_ok=True)
+            outpath = output_folder(outpath, self.album_or_playlist_name)
 
         try:
             self.start_download_worker(tracks_to_download, outpath)
@@ -1436,6 +1326,23 @@ class SpotizerGUI(QWidget):
             self.log_output.append(f"Error: An error occurred while starting the download: {str(e)}")
 
     def start_download_worker(self, tracks_to_download, outpath):
+        if self.worker_processes > 1 and len(tracks_to_download) > 1:
+            # the tracks are split over worker processes, each with its own Deezer sessions
+            self.worker = FleetWorker(self.arl_input.text().strip(), self.worker_processes, self.concurrent_downloads)
+            self.worker.coordinator.add_tracks(self.spotify_url.text().strip(), tracks_to_download, outpath,
+                                               self.album_or_playlist_name, {
+                "is_single_track": self.is_single_track,
+                "is_album": self.is_album,
+                "is_playlist": self.is_playlist,
+                "filename_format": self.filename_format,
+                "use_track_numbers": self.use_track_numbers,
+                "use_album_subfolders": self.use_album_subfolders,
+                "use_artist_subfolders": self.use_artist_subfolders,
+                "max_workers": self.concurrent_downloads,
+                "library_root": self.output_dir.text(),
+            })
+            self.run_download_worker()
+            return
         self.worker = DownloadWorker(
             tracks_to_download, 
             outpath, 
@@ -1447,14 +1354,65 @@ class SpotizerGUI(QWidget):
             self.filename_format,
             self.use_track_numbers,
             self.use_album_subfolders,
-            self.use_artist_subfolders
+            self.use_artist_subfolders,
+            self.concurrent_downloads,
+            store=self.job_store,
+            url=self.spotify_url.text().strip(),
+            library_root=self.output_dir.text()
         )
+        self.run_download_worker()
+
+    def run_download_worker(self):
         self.worker.finished.connect(self.on_download_finished)
         self.worker.progress.connect(self.update_progress)
         self.worker.start()
         self.start_timer()
         self.update_ui_for_download_start()
 
+    def log_unfinished_jobs(self):
+        jobs = self.job_store.unfinished_jobs()
+        if not jobs:
+            return
+        self.log_output.append("Unfinished downloads, use Resume Unfinished in the Process tab to continue:")
+        for job in jobs:
+            done = job["counts"].get("done", 0) + job["counts"].get("skipped", 0)
+            self.log_output.append(f"• {job['name'] or job['url']}: {done}/{sum(job['counts'].values())} tracks")
+
+    def resume_stored_job(self, job, retry_failed=False):
+        if not self.arl_input.text().strip():
+            self.log_output.append("Error: Please enter your Deezer ARL")
+            return
+        if not os.path.isdir(job["outpath"]):
+            self.log_output.append(f"Warning: Output directory {job['outpath']} no longer exists.")
+            return
+        if retry_failed:
+            self.job_store.reset_tracks(job["id"])
+        self.log_output.clear()
+        try:
+            self.worker = DownloadWorker(self.arl_input.text().strip(), resume_job_id=job["id"],
+                                         store=self.job_store, max_workers=self.concurrent_downloads)
+        except Exception as e:
+            self.log_output.append(f"Error: An error occurred while resuming the download: {str(e)}")
+            return
+        self.log_output.append(f"Resuming {job['name'] or job['url']}: {len(self.worker.downloader.tracks)} tracks")
+        self.run_download_worker()
+
+    def resume_unfinished_job(self):
+        # the most recent job with tracks left
+        jobs = self.job_store.unfinished_jobs()
+        if not jobs:
+            self.log_output.append("No unfinished downloads.")
+            return
+        self.resume_stored_job(jobs[0])
+
+    def retry_failed_tracks(self):
+        # the failed tracks of the most recent job that has some
+        jobs = self.job_store.jobs((FAILED,), limit=1)
+        if not jobs:
+            self.log_output.append("No failed downloads.")
+            return
+        self.resume_stored_job(jobs[0], retry_failed=True)
+
     def update_ui_for_download_start(self):
         self.download_selected_btn.setEnabled(False)
         self.download_all_btn.setEnabled(False)
@@ -1466,6 +1424,8 @@ class SpotizerGUI(QWidget):
             
         self.stop_btn.show()
         self.pause_resume_btn.show()
+        self.resume_jobs_btn.hide()
+        self.retry_failed_btn.hide()
         self.progress_bar.show()
         self.progress_bar.setValue(0)
         
@@ -1488,6 +1448,8 @@ class SpotizerGUI(QWidget):
         self.stop_btn.hide()
         self.pause_resume_btn.hide()
         self.pause_resume_btn.setText('Pause')
+        self.resume_jobs_btn.show()
+        self.retry_failed_btn.show()
         self.stop_timer()
         
         self.download_selected_btn.setEnabled(True)
@@ -1556,6 +1518,8 @@ class SpotizerGUI(QWidget):
         self.time_label.hide()
 
 if __name__ == '__main__':
+    # worker processes of a packaged build start through this script
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     
     settings = QSettings('Spotizer', 'Settings')
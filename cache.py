@@ -0,0 +1,212 @@
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def get_cache_dir():
+    # per-user cache directory, created on first use
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base, "Spotizer")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_data_dir():
+    # per-user application data directory, for state that isn't a cache
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    path = os.path.join(base, "Spotizer")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class IsrcCache:
+    """
+    On-disk ISRC -> Deezer track id cache, with the id of the track's album when it is known.
+    ISRCs Deezer doesn't know are stored as negative entries, which expire after negative_ttl seconds.
+    """
+    def __init__(self, path=None, negative_ttl=7 * 24 * 3600):
+        self.path = path or os.path.join(get_cache_dir(), "isrc.sqlite3")
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS isrc ("
+                " isrc TEXT PRIMARY KEY,"
+                " deezer_id TEXT,"
+                " updated_at REAL NOT NULL,"
+                " album_id TEXT)"
+            )
+            # caches written before album ids were kept
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(isrc)")]
+            if "album_id" not in columns:
+                self.conn.execute("ALTER TABLE isrc ADD COLUMN album_id TEXT")
+
+    def get(self, isrc):
+        # return (found, deezer_id), deezer_id is None for a negative entry
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT deezer_id, updated_at FROM isrc WHERE isrc = ?", (isrc,)
+            ).fetchone()
+        if row is None:
+            return False, None
+        deezer_id, updated_at = row
+        if deezer_id is None and time.time() - updated_at > self.negative_ttl:
+            return False, None
+        return True, deezer_id
+
+    def get_album(self, isrc):
+        # album id of the track with this ISRC, None if it isn't known
+        with self.lock:
+            row = self.conn.execute("SELECT album_id FROM isrc WHERE isrc = ?", (isrc,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, isrc, deezer_id, album_id=None):
+        # deezer_id None records that Deezer doesn't have this ISRC
+        # without album_id, an album id stored earlier for the same track is kept
+        with self.lock, self.conn:
+            if album_id is None and deezer_id is not None:
+                row = self.conn.execute("SELECT album_id FROM isrc WHERE isrc = ? AND deezer_id = ?",
+                                        (isrc, str(deezer_id))).fetchone()
+                album_id = row[0] if row else None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO isrc (isrc, deezer_id, updated_at, album_id) VALUES (?, ?, ?, ?)",
+                (isrc, None if deezer_id is None else str(deezer_id), time.time(),
+                 None if album_id is None else str(album_id))
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CoverCache:
+    """
+    Cover art cache keyed by Deezer's ALB_PICTURE id, which is itself a hash of the image.
+    Recently used covers are kept in memory up to max_memory bytes, all covers on disk up to
+    max_disk bytes, the least recently used ones are evicted first from both.
+    Concurrent requests for the same cover wait for a single download.
+    """
+    def __init__(self, path=None, max_memory=64 * 1024 * 1024, max_disk=512 * 1024 * 1024):
+        self.path = path or os.path.join(get_cache_dir(), "covers")
+        os.makedirs(self.path, exist_ok=True)
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.pending = {}
+        self.disk_size = sum(size for _, _, size in self._disk_entries())
+
+    def _file(self, key):
+        name = key if re.fullmatch(r"[0-9A-Za-z_-]+", key) else hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.path, name + ".jpg")
+
+    def _disk_entries(self):
+        # (path, mtime, size) of every cached file
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".jpg"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def contains(self, key):
+        with self.lock:
+            if key in self.memory or key in self.pending:
+                return True
+        return os.path.exists(self._file(key))
+
+    def get(self, key, fetch):
+        # return the cover bytes for key, calling fetch() to download them on a miss
+        while True:
+            with self.lock:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    return self.memory[key]
+                event = self.pending.get(key)
+                if event is None:
+                    self.pending[key] = threading.Event()
+                    break
+            # another thread is loading it, a failed load leaves the next attempt to us
+            event.wait()
+
+        try:
+            data = self._read_disk(key)
+            if data is None:
+                data = fetch()
+                self._write_disk(key, data)
+            self._remember(key, data)
+            return data
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def _read_disk(self, key):
+        path = self._file(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the mtime doubles as the last use for the disk eviction
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        path = self._file(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not cache cover {key}: {e}")
+            return
+        with self.lock:
+            self.disk_size += len(data)
+            if self.disk_size <= self.max_disk:
+                return
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # called with the lock held, trims the disk cache to 90% of max_disk
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+        self.disk_size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.disk_size <= self.max_disk * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_size -= size
+
+    def _remember(self, key, data):
+        with self.lock:
+            if key in self.memory:
+                return
+            self.memory[key] = data
+            self.memory_size += len(data)
+            while self.memory_size > self.max_memory and len(self.memory) > 1:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_size -= len(evicted)
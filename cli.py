@@ -0,0 +1,303 @@
+"""
+Command line Spotizer, for servers and scheduled jobs. Doesn't need PyQt6.
+
+    python -m cli [options] URL [URL ...]
+    python -m cli [options] -i urls.txt
+    cat urls.txt | python -m cli [options]
+    python -m cli [options] --resume
+    python -m cli [options] --sync -i playlists.txt
+    python -m cli --jobs
+
+Progress is written to stdout as one JSON object per line, everything else goes to stderr.
+Exits with 1 if a url or a track failed, with 2 on bad usage.
+Every job is recorded in the job store, --resume picks up the ones a crash or Ctrl+C cut short.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+from getMetadata import get_filtered_data, parse_uri, SpotifyClient, SpotifyInvalidUrlException
+from downloader import Downloader, tracks_from_metadata, output_folder
+from jobstore import JobStore
+from fleet import FleetCoordinator
+from library import LibraryIndex
+from sync import PlaylistSync
+
+
+class EventWriter:
+    """ writes events as JSON lines, from any thread """
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __call__(self, event, **data):
+        line = json.dumps({"event": event, **data}, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def read_urls(args, stdin):
+    # urls from the arguments, the input file ("-" is stdin), or stdin when it's piped
+    urls = list(args.urls)
+    lines = []
+    if args.input == "-":
+        lines = stdin.read().splitlines()
+    elif args.input:
+        with open(args.input, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    elif not urls and not stdin.isatty():
+        lines = stdin.read().splitlines()
+    urls.extend(line.strip() for line in lines if line.strip() and not line.strip().startswith("#"))
+    return urls
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Download Spotify tracks, albums and playlists from Deezer.")
+    parser.add_argument("urls", nargs="*", metavar="URL", help="Spotify track, album, playlist or artist discography url")
+    parser.add_argument("-i", "--input", metavar="FILE", help="read urls from FILE, one per line, - for stdin")
+    parser.add_argument("-o", "--output", default=os.getcwd(), help="output directory (default: current directory)")
+    parser.add_argument("--arl", default=os.environ.get("SPOTIZER_ARL", ""),
+                        help="Deezer ARL, several separated by commas (default: $SPOTIZER_ARL)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrent downloads per account (default: 4)")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="worker processes to spread the tracks over (default: 1)")
+    parser.add_argument("--filename-format", default="title_artist", choices=("title_artist", "artist_title", "title_only"))
+    parser.add_argument("--no-track-numbers", action="store_true", help="don't prefix album tracks with their number")
+    parser.add_argument("--album-subfolders", action="store_true", help="put playlist tracks in album folders")
+    parser.add_argument("--artist-subfolders", action="store_true", help="put playlist tracks in artist folders")
+    parser.add_argument("--resume", action="store_true", help="resume the unfinished jobs of earlier runs")
+    parser.add_argument("--retry-failed", type=int, action="append", default=[], metavar="JOB_ID",
+                        help="download the failed tracks of a job again")
+    parser.add_argument("--jobs", action="store_true", help="list the recorded jobs and exit")
+    parser.add_argument("--sync", action="store_true",
+                        help="only download the tracks a playlist gained since its last --sync, "
+                             "unchanged playlists cost a single request")
+    parser.add_argument("--removed", action="store_true",
+                        help="with --sync, emit a removed event for every track a playlist lost")
+    return parser, parser.parse_args(argv)
+
+
+def track_callback(url, emit):
+    def on_track(status, job, error):
+        track = job.track
+        emit("track", url=url, status=status, isrc=track.id, title=track.title, artists=track.artists,
+             path=job.full_path, error=error)
+    return on_track
+
+
+def run_downloader(downloader, url, emit, downloaders):
+    downloaders.append(downloader)
+    result = downloader.run()
+    if result is None:
+        return False
+    success, message, failed_tracks = result
+    emit("finished", url=url, job=downloader.job_id, success=success, message=message, failed=len(failed_tracks))
+    return success and not failed_tracks
+
+
+def prepare_url(url, args, client, emit, sync, library):
+    # fetch url's tracks, returns (tracks, name, kind, outpath, sync change) or None if there is
+    # nothing to download; with sync, a playlist only yields the tracks added since the last sync
+    change = None
+    try:
+        url_type = parse_uri(url)["type"]
+        if sync is not None and url_type == "playlist":
+            change = sync.changes(url, client)
+            if change is None:
+                emit("unchanged", url=url)
+                return None
+            metadata = change["metadata"]
+        else:
+            metadata = get_filtered_data(url, client=client)
+    except SpotifyInvalidUrlException as e:
+        emit("error", url=url, error=str(e))
+        return False
+    except Exception as e:
+        emit("error", url=url, error=f"Failed to fetch metadata: {e}")
+        return False
+    if "error" in metadata:
+        emit("error", url=url, error=metadata["error"])
+        return False
+
+    try:
+        tracks, name, kind = tracks_from_metadata(url_type, metadata)
+    except ValueError as e:
+        emit("error", url=url, error=str(e))
+        return False
+
+    if change is not None:
+        tracks = [track for track in tracks if track.id in change["added"]]
+        emit("sync", url=url, name=name, added=len(change["added"]), removed=len(change["removed"]))
+        if args.removed:
+            for isrc, track in change["removed"].items():
+                emit("removed", url=url, isrc=isrc, title=track["title"], artists=track["artists"],
+                     path=library.find(isrc, args.output))
+        if not tracks:
+            sync.save(change)
+            return None
+
+    outpath = args.output if kind == "track" else output_folder(args.output, name)
+    return tracks, name, kind, outpath, change
+
+
+def job_options(args, kind):
+    # the Downloader options of a job for a url of kind
+    return {
+        "is_single_track": kind == "track",
+        "is_album": kind == "album",
+        "is_playlist": kind == "playlist",
+        "filename_format": args.filename_format,
+        "use_track_numbers": not args.no_track_numbers,
+        "use_album_subfolders": args.album_subfolders,
+        "use_artist_subfolders": args.artist_subfolders,
+        "max_workers": args.workers,
+        "library_root": args.output,
+    }
+
+
+def download_url(url, args, client, emit, downloaders, store, sync, library):
+    # returns True if every track of url was downloaded or already there
+    prepared = prepare_url(url, args, client, emit, sync, library)
+    if not prepared:
+        return prepared is None
+    tracks, name, kind, outpath, change = prepared
+    emit("start", url=url, name=name, kind=kind, tracks=len(tracks), output=outpath)
+
+    downloader = Downloader(
+        tracks, outpath, args.arl, album_or_playlist_name=name, **job_options(args, kind),
+        on_progress=lambda message, percent: emit("progress", url=url, message=message, percent=percent),
+        on_track=track_callback(url, emit), store=store, url=url, library=library
+    )
+    ok = run_downloader(downloader, url, emit, downloaders)
+    # failed tracks stay in the job store for --retry-failed, the sync only waits for a run to end
+    if change is not None and downloader.job_id is not None and store.get_job(downloader.job_id)["status"] in ("done", "failed"):
+        sync.save(change)
+    return ok
+
+
+def resume_job(job, args, emit, downloaders, store):
+    # the job's unfinished tracks, with the options it was started with
+    url = job["url"]
+    if not os.path.isdir(job["outpath"]):
+        emit("error", url=url, job=job["id"], error=f"output directory {job['outpath']} doesn't exist")
+        return False
+    downloader = Downloader.from_store(
+        store, job["id"], args.arl,
+        on_progress=lambda message, percent: emit("progress", url=url, message=message, percent=percent),
+        on_track=track_callback(url, emit)
+    )
+    emit("start", url=url, job=job["id"], name=job["name"], tracks=len(downloader.tracks),
+         output=job["outpath"], resumed=True)
+    return run_downloader(downloader, url, emit, downloaders)
+
+
+def run_fleet(urls, jobs, args, client, emit, store, sync, library):
+    # every url and job goes into one run, whose tracks are shared by the worker processes
+    def on_track(status, item, error):
+        track = item["payload"]
+        emit("track", job=item["job_id"], status=status, isrc=track["id"], title=track["title"],
+             artists=track["artists"], error=error)
+
+    coordinator = FleetCoordinator(
+        args.arl, args.processes, args.workers, store_path=store.path,
+        on_progress=lambda message, percent: emit("progress", message=message, percent=percent),
+        on_track=on_track
+    )
+    failed_urls = 0
+    changes = []
+    for url in urls:
+        prepared = prepare_url(url, args, client, emit, sync, library)
+        if not prepared:
+            failed_urls += prepared is False
+            continue
+        tracks, name, kind, outpath, change = prepared
+        job_id = coordinator.add_tracks(url, tracks, outpath, name, job_options(args, kind))
+        if change is not None:
+            changes.append((job_id, change))
+        emit("queued", url=url, job=job_id)
+    for job in jobs:
+        coordinator.add_job(job["id"])
+        emit("queued", url=job["url"], job=job["id"], resumed=True)
+
+    try:
+        result = coordinator.run()
+    except KeyboardInterrupt:
+        coordinator.stop()
+        raise
+    success, message, failed_tracks = result
+    for job_id, change in changes:
+        if store.get_job(job_id)["status"] in ("done", "failed"):
+            sync.save(change)
+    emit("finished", success=success, message=message, failed=len(failed_tracks))
+    return failed_urls + (0 if success and not failed_tracks else 1)
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    store = JobStore()
+    if args.jobs:
+        emit = EventWriter(sys.stdout)
+        for job in store.jobs():
+            emit("job", **job)
+        return 0
+
+    resuming = args.resume or args.retry_failed
+    urls = read_urls(args, sys.stdin) if args.urls or args.input or not resuming else []
+    if not urls and not resuming:
+        parser.error("no urls given")
+    if not args.arl.strip():
+        parser.error("no Deezer ARL, use --arl or set SPOTIZER_ARL")
+    if not os.path.isdir(args.output):
+        parser.error(f"output directory {args.output} doesn't exist")
+
+    # the library modules print their logs, keep stdout for the events
+    emit = EventWriter(sys.stdout)
+    sys.stdout = sys.stderr
+
+    jobs = []
+    failed_urls = 0
+    for job_id in args.retry_failed:
+        job = store.get_job(job_id)
+        if job is None:
+            emit("error", job=job_id, error=f"no job {job_id}")
+            failed_urls += 1
+            continue
+        store.reset_tracks(job_id)
+        jobs.append(job)
+    if args.resume:
+        jobs.extend(job for job in reversed(store.unfinished_jobs()) if job["id"] not in args.retry_failed)
+
+    client = SpotifyClient(pool_size=args.workers)
+    sync = PlaylistSync() if args.sync else None
+    library = LibraryIndex()
+    downloaders = []
+    if args.processes > 1:
+        try:
+            failed_urls += run_fleet(urls, jobs, args, client, emit, store, sync, library)
+        except KeyboardInterrupt:
+            emit("stopped")
+            return 130
+        emit("summary", urls=len(urls), jobs=len(jobs), failed=failed_urls)
+        return 1 if failed_urls else 0
+    try:
+        for job in jobs:
+            if not resume_job(job, args, emit, downloaders, store):
+                failed_urls += 1
+        for url in urls:
+            if not download_url(url, args, client, emit, downloaders, store, sync, library):
+                failed_urls += 1
+    except KeyboardInterrupt:
+        for downloader in downloaders:
+            downloader.stop()
+        emit("stopped")
+        return 130
+
+    emit("summary", urls=len(urls), jobs=len(jobs), failed=failed_urls)
+    return 1 if failed_urls else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
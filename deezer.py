@@ -1,10 +1,19 @@
+import os
 import sys
 import re
+import io
 import json
+import uuid
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Optional, Sequence
 from random import randrange
 
 from configuration import config
+from cache import CoverCache
 
 def get_random_user_agent():
     return f"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_{randrange(11, 15)}_{randrange(4, 9)}) AppleWebKit/{randrange(530, 537)}.{randrange(30, 37)} (KHTML, like Gecko) Chrome/{randrange(80, 105)}.0.{randrange(3000, 4500)}.{randrange(60, 125)} Safari/{randrange(530, 537)}.{randrange(30, 36)}"
@@ -15,6 +24,8 @@ import struct
 import urllib.parse
 import html.parser
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from binascii import a2b_hex, b2a_hex
 
 
@@ -25,49 +36,34 @@ TYPE_PLAYLIST = "playlist"
 TYPE_ALBUM_TRACK = "album_track" # used for listing songs of an album
 # END TYPES
 
-session = None
-license_token = None
-
-
-def get_user_data():
-    global license_token
-    try:
-        user_data = session.get(
-            'https://www.deezer.com/ajax/gw-light.php?method=deezer.getUserData&input=3&api_version=1.0&api_token=')
-        user_data_json = user_data.json()['results']
-        options = user_data_json['USER']['OPTIONS']
-        license_token = options.get('license_token')
-        return user_data_json
-
-    except (Deezer403Exception, Deezer404Exception) as msg:
-        print(msg)
-        print("user data is not working anymore.")
-        return False
-
-
-def init_deezer_session(proxy_server):
-    global session
-    header = {
-        'Pragma': 'no-cache',
-        'Origin': 'https://www.deezer.com',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'User-Agent': get_random_user_agent(),
-        'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        'Accept': '*/*',
-        'Cache-Control': 'no-cache',
-        'X-Requested-With': 'XMLHttpRequest',
-        'Connection': 'keep-alive',
-        'Referer': 'https://www.deezer.com/login',
-        'DNT': '1',
-    }
-    session = requests.session()
-    session.headers.update(header)
-    session.cookies.update({'arl': config['deezer']['cookie_arl'], 'comeback': '1'})
-    if len(proxy_server.strip()) > 0:
-        print(f"Using proxy {proxy_server}")
-        session.proxies.update({"https": proxy_server})
-    get_user_data()
+# every song is split in 2048 byte blocks, the first block of each 3 block stripe is encrypted
+BLOCK_SIZE = 2048
+STRIPE_SIZE = 3 * BLOCK_SIZE
+BLOWFISH_IV = a2b_hex("0001020304050607")
+# bytes read, decrypted and written at once by decryptfile (a multiple of STRIPE_SIZE)
+DECRYPT_CHUNK_SIZE = 32 * STRIPE_SIZE
+# decrypted bytes between two saves of a transfer's resume journal (a multiple of DECRYPT_CHUNK_SIZE)
+JOURNAL_INTERVAL = 8 * DECRYPT_CHUNK_SIZE
+# seconds to wait for the song's cdn to connect or send more data
+TRANSFER_TIMEOUT = 30
+
+# number of track tokens sent per media.deezer.com/v1/get_url request
+MEDIA_URL_BATCH_SIZE = 25
+# number of song ids sent per gw-light song.getListData request
+SONG_DATA_BATCH_SIZE = 50
+# media.deezer.com get_url error codes about the license token: invalid or expired, or the
+# account's subscription doesn't cover the format. Every other code is about the track
+# itself (2002: not available in the account's country), whichever account asks
+MEDIA_TOKEN_ERROR_CODES = {1000, 1001, 2001}
+# covers a client loads in the background at once
+COVER_PREFETCH_WORKERS = 2
+
+# shared by every download, created on first use
+cover_cache = None
+_cover_cache_lock = threading.Lock()
+
+# per thread reusable transfer buffers
+_thread_state = threading.local()
 
 
 class Deezer404Exception(Exception):
@@ -82,6 +78,14 @@ class DeezerApiException(Exception):
     pass
 
 
+class DeezerMediaException(Exception):
+    """ a song the media api gave no url for, account tells if the account is to blame """
+    def __init__(self, message, code=None, account=False):
+        super().__init__(message)
+        self.code = code
+        self.account = account
+
+
 class ScriptExtractor(html.parser.HTMLParser):
     """ extract <script> tag contents from a html page """
     def __init__(self):
@@ -143,30 +147,131 @@ def blowfishDecrypt(data, key):
     return c.decrypt(data)
 
 
-def decryptfile(fh, key, fo):
+def decrypt_stripes(data, key):
+    """
+    Decrypt a buffer that starts on a stripe boundary.
+    Every whole 2048 byte block at the start of a 6144 byte stripe is encrypted,
+    all of them are decrypted with a single cipher call.
+    """
+    data = bytearray(data)
+    stripes = (len(data) + STRIPE_SIZE - 1) // STRIPE_SIZE
+    decrypt_stripes_into(memoryview(data), len(data), key, bytearray(stripes * (BLOCK_SIZE + len(BLOWFISH_IV))))
+    return data
+
+
+def decrypt_stripes_into(view, length, key, scratch):
+    """
+    In place version of decrypt_stripes for the first <length> bytes of the writable <view>.
+    <scratch> is a work buffer of at least 2056 bytes per stripe.
+    """
+    starts = range(0, length - BLOCK_SIZE + 1, STRIPE_SIZE)
+    if not starts:
+        return
+
+    # every block is its own CBC chain starting at the IV. Putting the IV in front of each
+    # block as an extra ciphertext block restarts the chain, so all blocks can be decrypted
+    # in one go, the 8 garbage bytes decrypted from each IV are skipped
+    iv_size = len(BLOWFISH_IV)
+    step = BLOCK_SIZE + iv_size
+    work = memoryview(scratch)[:len(starts) * step]
+    for n, start in enumerate(starts):
+        work[n * step:n * step + iv_size] = BLOWFISH_IV
+        work[n * step + iv_size:(n + 1) * step] = view[start:start + BLOCK_SIZE]
+    Blowfish.new(key.encode(), Blowfish.MODE_CBC, BLOWFISH_IV).decrypt(work, output=work)
+    for n, start in enumerate(starts):
+        view[start:start + BLOCK_SIZE] = work[n * step + iv_size:(n + 1) * step]
+
+
+def get_transfer_buffers():
+    # (read buffer, decrypt scratch buffer) of this thread, reused by all its transfers
+    buffers = getattr(_thread_state, 'transfer_buffers', None)
+    if buffers is None:
+        stripes = DECRYPT_CHUNK_SIZE // STRIPE_SIZE
+        buffers = (bytearray(DECRYPT_CHUNK_SIZE), bytearray(stripes * (BLOCK_SIZE + len(BLOWFISH_IV))))
+        _thread_state.transfer_buffers = buffers
+    return buffers
+
+
+def preallocate(fo, length):
+    # reserve <length> bytes from the current position so the file isn't grown write by write
+    # the caller has to truncate the file to what was actually written
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fo.fileno(), fo.tell(), length)
+        else:
+            fo.truncate(fo.tell() + length)
+    except OSError:
+        pass
+
+
+def write_all(fo, data):
+    # unbuffered files may write less than asked for
+    view = memoryview(data)
+    while view:
+        view = view[fo.write(view):]
+
+
+def decrypt_stream(raw, key, fo, size=0, on_progress=None):
+    """
+    Decrypt the stream <raw> (anything with readinto) and write it to file <fo>.
+    Same output as decryptfile, but the data is read into a reusable per thread buffer,
+    decrypted in place and written in chunks of DECRYPT_CHUNK_SIZE bytes.
+    When <size> is known it is reserved on disk up front.
+    <on_progress>(bytes written) is called after every whole chunk, so always on a stripe boundary.
+    """
+    buffer, scratch = get_transfer_buffers()
+    view = memoryview(buffer)
+    if size:
+        preallocate(fo, size)
+
+    written = 0
+    while True:
+        # only the last read may come up short, so every chunk starts on a stripe boundary
+        filled = 0
+        while filled < len(buffer):
+            read = raw.readinto(view[filled:])
+            if not read:
+                break
+            filled += read
+        if not filled:
+            break
+
+        decrypt_stripes_into(view, filled, key, scratch)
+        write_all(fo, view[:filled])
+        if filled < len(buffer):
+            break
+        written += filled
+        if on_progress:
+            on_progress(written)
+
+
+def decryptfile(fh, key, fo, chunk_size=DECRYPT_CHUNK_SIZE):
     """
     Decrypt data from file <fh>, and write to file <fo>.
     decrypt using blowfish with <key>.
     Only every third 2048 byte block is encrypted.
+    Data is decrypted and written in whole stripes of up to <chunk_size> bytes.
     """
-    blockSize = 2048
-    i = 0
+    pending = b""
 
-    for data in fh.iter_content(blockSize):
+    for data in fh.iter_content(chunk_size):
         if not data:
             break
 
-        isEncrypted = ((i % 3) == 0)
-        isWholeBlock = len(data) == blockSize
+        pending += data
+        usable = len(pending) - len(pending) % STRIPE_SIZE
+        if usable < chunk_size:
+            continue
 
-        if isEncrypted and isWholeBlock:
-            data = blowfishDecrypt(data, key)
+        fo.write(decrypt_stripes(pending[:usable], key))
+        pending = pending[usable:]
 
-        fo.write(data)
-        i += 1
+    if pending:
+        fo.write(decrypt_stripes(pending, key))
 
 
-def writeid3v1_1(fo, song):
+def writeid3v1_1(fo, song, album=None):
+    # album: the album data returned by get_song_infos_with_album, gives the year and label
 
     # Bugfix changed song["SNG_TITLE... to song.get("SNG_TITLE... to avoid 'key-error' in case the key does not exist
     def song_get(song, key):
@@ -176,9 +281,8 @@ def writeid3v1_1(fo, song):
             return b""
 
     def album_get(key):
-        global album_Data
         try:
-            return album_Data.get(key).encode('utf-8')
+            return album.get(key).encode('utf-8')
         except:
             return b""
 
@@ -199,9 +303,12 @@ def writeid3v1_1(fo, song):
     fo.write(data)
 
 
-def downloadpicture(pic_idid):
-    resp = session.get(get_picture_link(pic_idid))
-    return resp.content
+def get_cover_cache():
+    global cover_cache
+    with _cover_cache_lock:
+        if cover_cache is None:
+            cover_cache = CoverCache()
+        return cover_cache
 
 
 def get_picture_link(pic_idid):
@@ -210,19 +317,120 @@ def get_picture_link(pic_idid):
     return url
 
 
-def writeid3v2(fo, song):
+def make28bit(x):
+    return ((x << 3) & 0x7F000000) | ((x << 2) & 0x7F0000) | (
+           (x << 1) & 0x7F00) | (x & 0x7F)
+
+
+def maketag(tag, content):
+    return struct.pack(">4sLH", tag.encode("ascii"), len(content), 0) + content
+
+
+def makeutf8(txt):
+    #return b"\x03" + txt.encode('utf-8')
+    return "\x03{}".format(txt).encode()
+
+
+def makepic(data):
+    # Picture type:
+    # 0x00     Other
+    # 0x01     32x32 pixels 'file icon' (PNG only)
+    # 0x02     Other file icon
+    # 0x03     Cover (front)
+    # 0x04     Cover (back)
+    # 0x05     Leaflet page
+    # 0x06     Media (e.g. lable side of CD)
+    # 0x07     Lead artist/lead performer/soloist
+    # 0x08     Artist/performer
+    # 0x09     Conductor
+    # 0x0A     Band/Orchestra
+    # 0x0B     Composer
+    # 0x0C     Lyricist/text writer
+    # 0x0D     Recording Location
+    # 0x0E     During recording
+    # 0x0F     During performance
+    # 0x10     Movie/video screen capture
+    # 0x11     A bright coloured fish
+    # 0x12     Illustration
+    # 0x13     Band/artist logotype
+    # 0x14     Publisher/Studio logotype        
+    imgframe = (b"\x00",                 # text encoding
+                b"image/jpeg", b"\0",    # mime type
+                b"\x03",                 # picture type: 'Cover (front)'
+                b""[:64], b"\0",         # description
+                data
+                )
+
+    return b'' .join(imgframe)
+
+
+# album frames encoded by album_id3_frames, keyed by everything they are built from
+ALBUM_FRAMES_CACHE_SIZE = 16
+_album_frames = OrderedDict()
+_album_frames_lock = threading.Lock()
+
+
+def album_id3_frames(song, album=None, load_picture=None):
+    # the frames every track of an album shares, the cover is by far the biggest of them,
+    # so they are encoded once per album and reused as a byte template
+    # load_picture: returns the cover bytes for an ALB_PICTURE id, the default client's downloadpicture if None
+
+    def album_get(key):
+        try:
+            return album.get(key)
+        except:
+            #raise
+            return ""
+
+    key = tuple(str(album_get(k)) for k in ("PHYSICAL_RELEASE_DATE", "DIGITAL_RELEASE_DATE", "LABEL_NAME")) \
+        + (song.get("ALB_PICTURE"),)
+    with _album_frames_lock:
+        if key in _album_frames:
+            _album_frames.move_to_end(key)
+            return _album_frames[key]
+
+    # get Data as DDMM
+    try:
+        phyDate_YYYYMMDD = album_get("PHYSICAL_RELEASE_DATE") .split('-') #'2008-11-21'
+        phyDate_DDMM = phyDate_YYYYMMDD[2] + phyDate_YYYYMMDD[1]
+    except:
+        phyDate_DDMM = ''
+
+    frames = [
+        maketag("TORY", makeutf8(str(album_get("PHYSICAL_RELEASE_DATE")[:4]))),     # The 'Original release year' frame is intended for the year when the original recording was released. if for example the music in the file should be a cover of a previously released song
+        maketag("TYER", makeutf8(str(album_get("DIGITAL_RELEASE_DATE")[:4]))),     # The 'Year' frame is a numeric string with a year of the recording. This frames is always four characters long (until the year 10000).
+        maketag("TDAT", makeutf8(str(phyDate_DDMM))),     # The 'Date' frame is a numeric string in the DDMM format containing the date for the recording. This field is always four characters long.
+        maketag("TPUB", makeutf8(album_get("LABEL_NAME"))),     # The 'Publisher' frame simply contains the name of the label or publisher.
+        ]
+
+    try:
+        frames.append(maketag("APIC", makepic((load_picture or downloadpicture)(song["ALB_PICTURE"]))))
+    except Exception as e:
+        # not kept, the next track of the album tries the cover again
+        print("ERROR: no album cover?", e)
+        return b"".join(frames)
+
+    template = b"".join(frames)
+    with _album_frames_lock:
+        _album_frames[key] = template
+        while len(_album_frames) > ALBUM_FRAMES_CACHE_SIZE:
+            _album_frames.popitem(last=False)
+    return template
+
+
+def writeid3v2(fo, song, album=None, load_picture=None):
+    # album: the album data returned by get_song_infos_with_album, gives the dates, label and track count
+    for part in id3v2_parts(song, album, load_picture):
+        fo.write(part)
 
-    def make28bit(x):
-        return ((x << 3) & 0x7F000000) | ((x << 2) & 0x7F0000) | (
-               (x << 1) & 0x7F00) | (x & 0x7F)
 
-    def maketag(tag, content):
-        return struct.pack(">4sLH", tag.encode("ascii"), len(content), 0) + content
+def id3v2_parts(song, album=None, load_picture=None):
+    # return the ID3v2 tag as (header and track frames, album frames), the album frames are the
+    # template shared by every track of the album and are never copied into a per-track buffer
 
     def album_get(key):
-        global album_Data
         try:
-            return album_Data.get(key)
+            return album.get(key)
         except:
             #raise
             return ""
@@ -234,49 +442,6 @@ def writeid3v2(fo, song):
             #raise
             return ""
 
-    def makeutf8(txt):
-        #return b"\x03" + txt.encode('utf-8')
-        return "\x03{}".format(txt).encode()
-
-    def makepic(data):
-        # Picture type:
-        # 0x00     Other
-        # 0x01     32x32 pixels 'file icon' (PNG only)
-        # 0x02     Other file icon
-        # 0x03     Cover (front)
-        # 0x04     Cover (back)
-        # 0x05     Leaflet page
-        # 0x06     Media (e.g. lable side of CD)
-        # 0x07     Lead artist/lead performer/soloist
-        # 0x08     Artist/performer
-        # 0x09     Conductor
-        # 0x0A     Band/Orchestra
-        # 0x0B     Composer
-        # 0x0C     Lyricist/text writer
-        # 0x0D     Recording Location
-        # 0x0E     During recording
-        # 0x0F     During performance
-        # 0x10     Movie/video screen capture
-        # 0x11     A bright coloured fish
-        # 0x12     Illustration
-        # 0x13     Band/artist logotype
-        # 0x14     Publisher/Studio logotype        
-        imgframe = (b"\x00",                 # text encoding
-                    b"image/jpeg", b"\0",    # mime type
-                    b"\x03",                 # picture type: 'Cover (front)'
-                    b""[:64], b"\0",         # description
-                    data
-                    )
-
-        return b'' .join(imgframe)
-
-    # get Data as DDMM
-    try:
-        phyDate_YYYYMMDD = album_get("PHYSICAL_RELEASE_DATE") .split('-') #'2008-11-21'
-        phyDate_DDMM = phyDate_YYYYMMDD[2] + phyDate_YYYYMMDD[1]
-    except:
-        phyDate_DDMM = ''
-
     # get size of first item in the list that is not 0
     try:
         FileSize = [
@@ -302,10 +467,6 @@ def writeid3v2(fo, song):
     id3 = [
         maketag("TRCK", makeutf8(track)),     # The 'Track number/Position in set' frame is a numeric string containing the order number of the audio-file on its original recording. This may be extended with a "/" character and a numeric string containing the total numer of tracks/elements on the original recording. E.g. "4/9".
         maketag("TLEN", makeutf8(str(int(song["DURATION"]) * 1000))),     # The 'Length' frame contains the length of the audiofile in milliseconds, represented as a numeric string.
-        maketag("TORY", makeutf8(str(album_get("PHYSICAL_RELEASE_DATE")[:4]))),     # The 'Original release year' frame is intended for the year when the original recording was released. if for example the music in the file should be a cover of a previously released song
-        maketag("TYER", makeutf8(str(album_get("DIGITAL_RELEASE_DATE")[:4]))),     # The 'Year' frame is a numeric string with a year of the recording. This frames is always four characters long (until the year 10000).
-        maketag("TDAT", makeutf8(str(phyDate_DDMM))),     # The 'Date' frame is a numeric string in the DDMM format containing the date for the recording. This field is always four characters long.
-        maketag("TPUB", makeutf8(album_get("LABEL_NAME"))),     # The 'Publisher' frame simply contains the name of the label or publisher.
         maketag("TSIZ", makeutf8(str(FileSize))),     # The 'Size' frame contains the size of the audiofile in bytes, excluding the ID3v2 tag, represented as a numeric string.
         maketag("TFLT", makeutf8("MPG/3")),
 
@@ -322,12 +483,9 @@ def writeid3v2(fo, song):
         )
     ])
 
-    try:
-        id3.append(maketag("APIC", makepic(downloadpicture(song["ALB_PICTURE"]))))
-    except Exception as e:
-        print("ERROR: no album cover?", e)
-
+    # only the track frames are encoded here, the album frames come from the template
     id3data = b"".join(id3)
+    album_frames = album_id3_frames(song, album, load_picture)
 #>      big-endian
 #s      char[]  bytes
 #H      unsigned short  integer 2
@@ -339,257 +497,788 @@ def writeid3v2(fo, song):
                       "ID3".encode("ascii"),
                       0x300,   # version
                       0x00,    # flags
-                      make28bit(len(id3data)))
+                      make28bit(len(id3data) + len(album_frames)))
+
+    return hdr + id3data, album_frames
+
+
+def make_id3_tags(song, album=None, load_picture=None):
+    # return (id3v2, id3v1.1) tags for song, so they can be built ahead of the transfer
+    # id3v2 is the tuple of bytes parts id3v2_parts returns, written one after the other
+    # album: the album data returned alongside the song by get_song_infos_with_album
+    id3v1 = io.BytesIO()
+    writeid3v1_1(id3v1, song, album)
+    return id3v2_parts(song, album, load_picture), id3v1.getvalue()
+
+
+def unsynchsafe(x):
+    # inverse of make28bit
+    return ((x & 0x7F000000) >> 3) | ((x & 0x7F0000) >> 2) | ((x & 0x7F00) >> 1) | (x & 0x7F)
+
+
+def read_id3_text(fo, frame_id):
+    # return the text of frame frame_id in the ID3v2.3/2.4 tag at the start of fo, None if there is none
+    # only the frame headers are read until the frame turns up, the cover art is skipped over
+    header = fo.read(10)
+    if len(header) < 10 or header[:3] != b"ID3" or header[3] not in (3, 4):
+        return None
+    version, flags = header[3], header[5]
+    end = 10 + unsynchsafe(struct.unpack(">L", header[6:10])[0])
+    position = 10
+    if flags & 0x40:
+        # extended header, its size counts itself in 2.4 but not in 2.3
+        size = fo.read(4)
+        if len(size) < 4:
+            return None
+        size = struct.unpack(">L", size)[0]
+        position += unsynchsafe(size) if version == 4 else size + 4
+        fo.seek(position)
+    while position + 10 <= end:
+        frame_header = fo.read(10)
+        if len(frame_header) < 10 or frame_header[0] == 0:
+            return None
+        size = struct.unpack(">L", frame_header[4:8])[0]
+        if version == 4:
+            size = unsynchsafe(size)
+        if frame_header[:4] == frame_id.encode("ascii"):
+            data = fo.read(size)
+            if not data or len(data) < size:
+                return None
+            encoding = {0: "latin-1", 1: "utf-16", 2: "utf-16-be"}.get(data[0], "utf-8")
+            return data[1:].decode(encoding, "replace").rstrip("\x00")
+        position += 10 + size
+        fo.seek(position)
+    return None
+
+
+def get_song_quality(song):
+    # pick the best MP3 quality deezer has a file for
+    return 3 if song.get("FILESIZE_MP3_320") and song.get("FILESIZE_MP3_320") != '0' else \
+           5 if song.get("FILESIZE_MP3_256") and song.get("FILESIZE_MP3_256") != '0' else \
+           1
+
+
+def get_song_filesize(song):
+    # size of the file get_song_quality picks, as announced by deezer
+    quality = get_song_quality(song)
+    key = "FILESIZE_MP3_320" if quality == 3 else "FILESIZE_MP3_256" if quality == 5 else "FILESIZE_MP3_128"
+    try:
+        return int(song.get(key) or 0)
+    except ValueError:
+        return 0
 
-    fo.write(hdr)
-    fo.write(id3data)
 
+def read_transfer_journal(journal_name):
+    try:
+        with open(journal_name, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-def get_song_url(song, quality=3):
-    global license_token
 
-    if not song.get('TRACK_TOKEN'):
-        raise ValueError("Missing track token in song data.")
+def write_transfer_journal(journal_name, state):
+    # replace the journal atomically so a crash never leaves half of it behind
+    with open(journal_name + ".tmp", "w", encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(journal_name + ".tmp", journal_name)
 
-    if not license_token:
-        raise ValueError("Missing license token.")
 
-    track_format = "MP3_320" if quality == 3 else "MP3_256" if quality == 5 else "MP3_128"
+class DeezerClient:
+    """
+    A logged in deezer.com session: the account's ARL cookie, the license and api tokens that
+    come with it, an optional proxy and a connection pool sized for pool_size concurrent requests.
+    Every client is independent, so several workers or accounts can each hold their own.
+    """
+    def __init__(self, arl, proxy_server="", pool_size=10):
+        self.arl = arl
+        self.proxy_server = proxy_server
+        self.pool_size = pool_size
+        self.license_token = None
+        self.api_token = None
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=COVER_PREFETCH_WORKERS,
+                                                    thread_name_prefix="cover-prefetch")
+        self.prefetching = set()
+        self.prefetch_lock = threading.Lock()
+
+        header = {
+            'Pragma': 'no-cache',
+            'Origin': 'https://www.deezer.com',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'User-Agent': get_random_user_agent(),
+            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+            'Accept': '*/*',
+            'Cache-Control': 'no-cache',
+            'X-Requested-With': 'XMLHttpRequest',
+            'Connection': 'keep-alive',
+            'Referer': 'https://www.deezer.com/login',
+            'DNT': '1',
+        }
+        self.session = requests.session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(header)
+        self.session.cookies.update({'arl': arl, 'comeback': '1'})
+        # media urls and the CDN get a session of their own, without the deezer.com cookies
+        # and headers but with the same proxy and connection pool size
+        self.media_session = requests.session()
+        media_adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.media_session.mount('https://', media_adapter)
+        self.media_session.mount('http://', media_adapter)
+        self.media_session.headers.update({'User-Agent': header['User-Agent']})
+        if len(proxy_server.strip()) > 0:
+            print(f"Using proxy {proxy_server}")
+            self.session.proxies.update({"https": proxy_server})
+            self.media_session.proxies.update({"https": proxy_server})
+        self.get_user_data()
+
+    def get_user_data(self):
+        try:
+            user_data = self.session.get(
+                'https://www.deezer.com/ajax/gw-light.php?method=deezer.getUserData&input=3&api_version=1.0&api_token=')
+            user_data_json = user_data.json()['results']
+            options = user_data_json['USER']['OPTIONS']
+            self.license_token = options.get('license_token')
+            self.api_token = user_data_json.get('checkForm')
+            return user_data_json
+
+        except (Deezer403Exception, Deezer404Exception) as msg:
+            print(msg)
+            print("user data is not working anymore.")
+            return False
+
+    def fetch_picture(self, pic_idid):
+        resp = self.session.get(get_picture_link(pic_idid))
+        # an error page must not end up in the cache
+        resp.raise_for_status()
+        return resp.content
+
+    def downloadpicture(self, pic_idid):
+        return get_cover_cache().get(pic_idid, lambda: self.fetch_picture(pic_idid))
+
+    def prefetch_picture(self, pic_idid):
+        # queue a cover to load in the background, so the tag step finds it cached
+        # a cover already cached, loading or queued is skipped
+        if not pic_idid or get_cover_cache().contains(pic_idid):
+            return
+        with self.prefetch_lock:
+            if pic_idid in self.prefetching:
+                return
+            self.prefetching.add(pic_idid)
+
+        def load():
+            try:
+                self.downloadpicture(pic_idid)
+            except Exception as e:
+                print(f"Cover prefetch failed for {pic_idid}: {e}")
+            finally:
+                with self.prefetch_lock:
+                    self.prefetching.discard(pic_idid)
+
+        self.prefetch_executor.submit(load)
+
+    def make_id3_tags(self, song, album=None):
+        # make_id3_tags with the cover loaded through this client
+        return make_id3_tags(song, album, self.downloadpicture)
+
+    def get_song_url(self, song, quality=3):
+        if not song.get('TRACK_TOKEN'):
+            raise ValueError("Missing track token in song data.")
+
+        song, url, file_extension, error = self.get_song_urls([song], quality)[0]
+        if error:
+            raise error
+
+        return song, url, file_extension
+
+    def get_song_urls(self, songs, quality=None, batch_size=MEDIA_URL_BATCH_SIZE):
+        # resolves the download urls of many songs with one get_url request per batch of track tokens
+        # songs: list of dicts with information of the songs (grabbed from Deezer.com)
+        # quality: see get_song_url, None picks the best quality of every song (get_song_quality)
+        # return: list of (song, url, file_extension, error) in the order of songs, error is None on
+        #         success, a DeezerMediaException otherwise
+        # raises Deezer403Exception if the client has no license token
+
+        if not self.license_token:
+            raise Deezer403Exception("Missing license token.")
+
+        results = [None] * len(songs)
+        indices_by_quality = {}
+        for index, song in enumerate(songs):
+            if not song.get('TRACK_TOKEN'):
+                results[index] = (song, None, None, DeezerMediaException("Missing track token in song data."))
+                continue
+            song_quality = quality if quality is not None else get_song_quality(song)
+            indices_by_quality.setdefault(song_quality, []).append(index)
+
+        for song_quality, indices in indices_by_quality.items():
+            track_format = "MP3_320" if song_quality == 3 else "MP3_256" if song_quality == 5 else "MP3_128"
+            file_extension = ".mp3" if "mp3" in track_format.lower() else ".flac"
+
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start + batch_size]
+                try:
+                    response = self.media_session.post(
+                        "https://media.deezer.com/v1/get_url",
+                        json={
+                            'license_token': self.license_token,
+                            'media': [{
+                                'type': "FULL",
+                                'formats': [{'cipher': "BF_CBC_STRIPE", 'format': track_format}]
+                            }],
+                            'track_tokens': [songs[i]['TRACK_TOKEN'] for i in batch]
+                        }
+                    )
+                    response.raise_for_status()
+                    body = response.json()
+                except requests.exceptions.RequestException as e:
+                    # a refused request is the account's, a network error nobody's
+                    status = e.response.status_code if e.response is not None else None
+                    error = DeezerMediaException(f"Failed to retrieve song URL: {e}", status,
+                                                 account=status in (401, 403))
+                    for i in batch:
+                        results[i] = (songs[i], None, None, error)
+                    continue
+
+                # errors for the whole request are about the license token
+                if body.get('errors'):
+                    error = DeezerMediaException(f"Error in API response: {body['errors']}",
+                                                 body['errors'][0].get('code'), account=True)
+                    for i in batch:
+                        results[i] = (songs[i], None, None, error)
+                    continue
+
+                # the api answers with one entry per track token, in request order
+                data = body.get('data') or []
+                for position, i in enumerate(batch):
+                    entry = data[position] if position < len(data) else None
+                    if entry and entry.get('errors'):
+                        code = entry['errors'][0].get('code')
+                        results[i] = (songs[i], None, None, DeezerMediaException(
+                            f"Error in API response: {entry['errors']}", code, account=code in MEDIA_TOKEN_ERROR_CODES))
+                    elif not entry or not entry.get('media'):
+                        results[i] = (songs[i], None, None, DeezerMediaException(f"Error in API response: {entry}"))
+                    else:
+                        results[i] = (songs[i], entry['media'][0]['sources'][0]['url'], file_extension, None)
+
+        return results
+
+    def transfer_song(self, song, url, file_name, tags=None, album=None, part_name=None):
+        # streams and decrypts a song whose media url is already resolved
+        # song: dict with information of the song (grabbed from Deezer.com)
+        # tags: (id3v2 parts, id3v1.1 bytes) from make_id3_tags, built here from song and album if not given
+        # the song is written to part_name (<file_name>.part by default) and renamed when complete.
+        # Progress is kept in the journal <part_name>.json, so an interrupted transfer resumes from
+        # the last stripe it saved
+        key = calcbfkey(song["SNG_ID"])
+        id3v2, id3v1 = tags if tags is not None else self.make_id3_tags(song, album)
+        header_size = sum(len(part) for part in id3v2)
+        part_name = part_name or file_name + ".part"
+        journal_name = part_name + ".json"
+
+        # audio bytes on disk are only trusted if they belong to the same song behind the same tag
+        state = read_transfer_journal(journal_name)
+        offset = 0
+        if state and state.get('sng_id') == str(song["SNG_ID"]) and state.get('header_size') == header_size \
+                and os.path.exists(part_name) and os.path.getsize(part_name) >= header_size + state.get('offset', 0):
+            offset = state.get('offset', 0)
 
-    try:
-        response = requests.post(
-            "https://media.deezer.com/v1/get_url",
-            json={
-                'license_token': license_token,
-                'media': [{
-                    'type': "FULL",
-                    'formats': [{'cipher': "BF_CBC_STRIPE", 'format': track_format}]
-                }],
-                'track_tokens': [song['TRACK_TOKEN']]
-            }
-        )
-        response.raise_for_status()
-        data = response.json()
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"Failed to retrieve song URL: {e}")
+        try:
+            response = self.media_session.get(url, stream=True, timeout=TRANSFER_TIMEOUT,
+                                    headers={'Range': f'bytes={offset}-'} if offset else None)
+            response.raise_for_status()
+            # only a 206 for the same file lets us continue, anything else starts over
+            total = int(response.headers.get('Content-Range', '/0').rsplit('/', 1)[-1] or 0) \
+                if response.status_code == 206 else int(response.headers.get('Content-Length') or 0)
+            if offset and (response.status_code != 206 or total != state.get('size')):
+                response.close()
+                offset = 0
+                response = self.media_session.get(url, stream=True, timeout=TRANSFER_TIMEOUT)
+                response.raise_for_status()
+                total = int(response.headers.get('Content-Length') or 0)
+
+            with response:
+                response.raw.decode_content = True
+                total = total or get_song_filesize(song)
+                journal = {'sng_id': str(song["SNG_ID"]), 'header_size': header_size, 'size': total, 'offset': offset}
+                saved = [offset]
+
+                def on_progress(written):
+                    if offset + written - saved[0] >= JOURNAL_INTERVAL:
+                        saved[0] = journal['offset'] = offset + written
+                        write_transfer_journal(journal_name, journal)
+
+                with open(part_name, "r+b" if offset else "w+b", buffering=0) as fo:
+                    if offset:
+                        fo.seek(header_size + offset)
+                    else:
+                        # Add song cover and first 30 seconds of unencrypted data
+                        for part in id3v2:
+                            write_all(fo, part)
+                        write_transfer_journal(journal_name, journal)
+                    remaining = total - offset if total > offset else 0
+                    decrypt_stream(response.raw, key, fo, remaining + len(id3v1) if remaining else 0, on_progress)
+                    write_all(fo, id3v1)
+                    fo.truncate()
+        except (requests.exceptions.RequestException, Urllib3HTTPError, ConnectionError) as e:
+            # the stream is read through urllib3 directly, so its errors aren't wrapped by requests
+            raise RuntimeError(f"Download failed: {e}")
+
+        os.replace(part_name, file_name)
+        try:
+            os.remove(journal_name)
+        except OSError:
+            pass
+
+    def download_song(self, song, output_file, album=None):
+        # downloads and decrypts the song from Deezer. Adds ID3 and art cover
+        # song: dict with information of the song (grabbed from Deezer.com)
+        # output_file: absolute file name of the output file, its extension is replaced by the one
+        #              of the format deezer serves
+        # album: album data returned alongside the song by get_song_infos_with_album, used for the tags
+        # return: (file name the song was written to, extension)
+        # raises RuntimeError if the song could not be downloaded
+        assert type(song) == dict, "song must be a dict"
+        assert type(output_file) == str, "output_file must be a str"
 
-    if not data.get('data') or 'errors' in data['data'][0]:
-        raise RuntimeError(f"Error in API response: {data}")
+        try:
+            song, url, extension = self.get_song_url(song, get_song_quality(song))
+        except Exception as e:
+            raise RuntimeError(f"Failed to get song URL: {e}")
+
+        if not url:
+            raise RuntimeError("Failed to get song URL: no url")
+
+        extension = extension.lower()
+        file_name = os.path.splitext(output_file)[0] + extension
+        # the partial file gets a name of its own, so two download_song calls for the same file never
+        # share one. Created with open so it gets the usual umask permissions, mkstemp's are 0600
+        part_name = f"{file_name}.{uuid.uuid4().hex}.part"
+        open(part_name, "xb").close()
+        try:
+            self.transfer_song(song, url, file_name, album=album, part_name=part_name)
+        except BaseException:
+            for name in (part_name, part_name + ".json"):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+            raise
+        print("Dowload finished: {}".format(file_name))
+        return file_name, extension
+
+    def gw_api_call(self, method, args=None):
+        # calls a method of deezer's gw-light json api (the one behind deezer.com)
+        # the api token is fetched with get_user_data and refreshed once if deezer rejects it
+        # raises DeezerApiException if the api returns an error
+        for attempt in range(2):
+            if not self.api_token:
+                self.get_user_data()
+            resp = self.session.post(
+                "https://www.deezer.com/ajax/gw-light.php",
+                params={'method': method, 'input': 3, 'api_version': '1.0', 'api_token': self.api_token or ''},
+                json=args or {})
+            data = resp.json()
+            error = data.get('error')
+            if error and attempt == 0 and 'VALID_TOKEN_REQUIRED' in error:
+                self.api_token = None
+                continue
+            if error:
+                raise DeezerApiException("ERROR: deezer api said {}".format(error))
+            return data['results']
+
+    def get_songs_data(self, song_ids, batch_size=SONG_DATA_BATCH_SIZE):
+        # bulk version of get_song_infos_from_deezer_website(TYPE_TRACK, id) for many songs
+        # song_ids: deezer SNG_IDs
+        # return: dict SNG_ID (str) -> song, ids deezer has no data for are left out
+        # raises DeezerApiException if something with the Deezer API is broken
+        song_ids = [str(song_id) for song_id in song_ids]
+        songs = {}
+        for start in range(0, len(song_ids), batch_size):
+            results = self.gw_api_call('song.getListData', {'sng_ids': song_ids[start:start + batch_size]})
+            for song in results.get('data', []):
+                songs[str(song['SNG_ID'])] = song
+        return songs
+
+    def get_song_infos_from_deezer_website(self, search_type, id):
+        # search_type: either one of the constants: TYPE_TRACK|TYPE_ALBUM|TYPE_PLAYLIST
+        # id: deezer_id of the song/album/playlist (like https://www.deezer.com/de/track/823267272)
+        # return: if TYPE_TRACK => song (dict grabbed from the website with information about a song)
+        # return: if TYPE_ALBUM|TYPE_PLAYLIST => list of songs
+        # raises the same exceptions as get_song_infos_with_album
+        return self.get_song_infos_with_album(search_type, id)[0]
+
+    def get_song_infos_with_album(self, search_type, id):
+        # like get_song_infos_from_deezer_website, but also returns the page's DATA dict
+        # return: (song or list of songs, album data), the album data holds the release dates and
+        #         label the ID3 tags need, pass it on to make_id3_tags/download_song
+        # raises
+        # Deezer404Exception if
+        # 1. open playlist https://www.deezer.com/de/playlist/1180748301 and click on song Honey from Moby in a new tab:
+        # 2. Deezer gives you a 404: https://www.deezer.com/de/track/68925038
+        # Deezer403Exception if we are not logged in
+
+        url = "https://www.deezer.com/us/{}/{}".format(search_type, id)
+        resp = self.session.get(url)
+        if resp.status_code == 404:
+            raise Deezer404Exception("ERROR: Got a 404 for {} from Deezer".format(url))
+        if "MD5_ORIGIN" not in resp.text:
+            raise Deezer403Exception("ERROR: we are not logged in on deezer.com. Please update the cookie")
+
+        parser = ScriptExtractor()
+        parser.feed(resp.text)
+        parser.close()
+
+        songs = []
+        album_Data = None
+        for script in parser.scripts:
+            regex = re.search(r'{"DATA":.*', script)
+            if regex:
+                DZR_APP_STATE = json.loads(regex.group())
+                album_Data = DZR_APP_STATE.get("DATA")
+                if DZR_APP_STATE['DATA']['__TYPE__'] == 'playlist' or DZR_APP_STATE['DATA']['__TYPE__'] == 'album':
+                    # songs if you searched for album/playlist
+                    for song in DZR_APP_STATE['SONGS']['data']:
+                        songs.append(song)
+                elif DZR_APP_STATE['DATA']['__TYPE__'] == 'song':
+                    # just one song on that page
+                    songs.append(DZR_APP_STATE['DATA'])
+        return (songs[0] if search_type == TYPE_TRACK else songs), album_Data
+
+    def deezer_search(self, search, search_type):
+        # search: string (What are you looking for?)
+        # search_type: either one of the constants: TYPE_TRACK|TYPE_ALBUM|TYPE_ALBUM_TRACK (TYPE_PLAYLIST is not supported)
+        # return: list of dicts (keys depend on search_type)
+
+        if search_type not in [TYPE_TRACK, TYPE_ALBUM, TYPE_ALBUM_TRACK]:
+            print("ERROR: search_type is wrong: {}".format(search_type))
+            return []
+        search = urllib.parse.quote_plus(search)
+        if search_type == TYPE_ALBUM_TRACK:
+            resp = self.get_song_infos_from_deezer_website(TYPE_ALBUM, search)
+        else:
+            resp = self.session.get("https://api.deezer.com/search/{}?q={}".format(search_type, search)).json()['data']
+        return_nice = []
+        for item in resp:
+            i = {}
+            if search_type == TYPE_ALBUM:
+                i['id'] = str(item['id'])
+                i['id_type'] = TYPE_ALBUM
+                i['album'] = item['title']
+                i['album_id'] = item['id']
+                i['img_url'] = item['cover_small']
+                i['artist'] = item['artist']['name']
+                i['title'] = ''
+                i['preview_url'] = ''
+
+            if search_type == TYPE_TRACK:
+                i['id'] = str(item['id'])
+                i['id_type'] = TYPE_TRACK
+                i['title'] = item['title']
+                i['img_url'] = item['album']['cover_small']
+                i['album'] = item['album']['title']
+                i['album_id'] = item['album']['id']
+                i['artist'] = item['artist']['name']
+                i['preview_url'] = item['preview']
+
+            if search_type == TYPE_ALBUM_TRACK:
+                i['id'] = str(item['SNG_ID'])
+                i['id_type'] = TYPE_TRACK
+                i['title'] = item['SNG_TITLE']
+                i['img_url'] = '' # item['album']['cover_small']
+                i['album'] = item['ALB_TITLE']
+                i['album_id'] = item['ALB_ID']
+                i['artist'] = item['ART_NAME']
+                i['preview_url'] = next(media['HREF'] for media in item['MEDIA'] if media['TYPE'] == 'preview')
+
+            return_nice.append(i)
+        return return_nice
+
+    def parse_deezer_playlist(self, playlist_id):
+        # playlist_id: id of the playlist or the url of it
+        # e.g. https://www.deezer.com/de/playlist/6046721604 or 6046721604
+        # return (playlist_name, list of songs) (song is a dict with information about the song)
+        # raises DeezerApiException if something with the Deezer API is broken
 
-    file_extension = ".mp3" if "mp3" in track_format.lower() else ".flac"
+        try:
+            playlist_id = re.search(r'\d+', playlist_id).group(0)
+        except AttributeError:
+            raise DeezerApiException("ERROR: Regex (\\d+) for playlist_id failed. You gave me '{}'".format(playlist_id))
+
+        url_get_csrf_token = "https://www.deezer.com/ajax/gw-light.php?method=deezer.getUserData&input=3&api_version=1.0&api_token="
+        req = self.session.post(url_get_csrf_token)
+        csrf_token = req.json()['results']['checkForm']
+
+        url_get_playlist_songs = "https://www.deezer.com/ajax/gw-light.php?method=deezer.pagePlaylist&input=3&api_version=1.0&api_token={}".format(csrf_token)
+        data = {'playlist_id': int(playlist_id),
+                'start': 0,
+                'tab': 0,
+                'header': True,
+                'lang': 'de',
+                'nb': 500}
+        req = self.session.post(url_get_playlist_songs, json=data)
+        json = req.json()
+
+        if len(json['error']) > 0:
+            raise DeezerApiException("ERROR: deezer api said {}".format(json['error']))
+        json_data = json['results']
+
+        playlist_name = json_data['DATA']['TITLE']
+        number_songs = json_data['DATA']['NB_SONG']
+        print("Playlist '{}' has {} songs".format(playlist_name, number_songs))
+
+        print("Got {} songs from API".format(json_data['SONGS']['count']))
+        return playlist_name, json_data['SONGS']['data']
+
+    def get_deezer_favorites(self, user_id: str) -> Optional[Sequence[int]]:
+        if not user_id.isnumeric():
+            raise Exception(f"User id '{user_id}' must be numeric")
+        resp = self.session.get(f"https://api.deezer.com/user/{user_id}/tracks?limit=10000000000")
+        assert resp.status_code == 200, f"got invalid status asking for favorite song\n{resp.text}s"
+        resp_json = resp.json()
+        if "error" in resp_json.keys():
+            raise Exception(f"Upstream api error getting favorite songs for user {user_id}:\n{resp_json['error']}")
+        # check is set next
+
+        while "next" in resp_json.keys():
+            resp = self.session.get(resp_json["next"])
+            assert resp.status_code == 200, f"got invalid status asking for favorite song\n{resp.text}s"
+            resp_json_next = resp.json()
+            if "error" in resp_json_next.keys():
+                raise Exception(f"Upstream api error getting favorite songs for user {user_id}:\n{resp_json_next['error']}")
+            resp_json["data"] += resp_json_next["data"]
+
+            if "next" in resp_json_next.keys():
+                resp_json["next"] = resp_json_next["next"]
+            else:
+                del resp_json["next"]
+
+        print(f"Got {resp_json['total']} favorite songs for user {user_id} from the api")
+        songs = [song['id'] for song in resp_json['data']]
+        return songs
+
+    def test_deezer_login(self):
+        print("Let's check if the deezer login is still working")
+        try:
+            song = self.get_song_infos_from_deezer_website(TYPE_TRACK, "917265")
+        except (Deezer403Exception, Deezer404Exception) as msg:
+            print(msg)
+            print("Login is not working anymore.")
+            return False
+
+        if song:
+            print("Login is still working.")
+            return True
+        else:
+            print("Login is not working anymore.")
+            return False
 
-    return song, data['data'][0]['media'][0]['sources'][0]['url'], file_extension
 
+def split_arls(text):
+    # ARLs of several accounts, separated by commas, semicolons or whitespace
+    return [arl for arl in re.split(r'[\s,;]+', text or '') if arl]
 
-def download_song(song, output_file):
-    # downloads and decrypts the song from Deezer. Adds ID3 and art cover
-    # song: dict with information of the song (grabbed from Deezer.com)
-    # output_file: absolute file name of the output file
-    assert type(song) == dict, "song must be a dict"
-    assert type(output_file) == str, "output_file must be a str"
 
-    song_quality = 3 if song.get("FILESIZE_MP3_320") and song.get("FILESIZE_MP3_320") != '0' else \
-                   5 if song.get("FILESIZE_MP3_256") and song.get("FILESIZE_MP3_256") != '0' else \
-                   1
+def is_account_error(error):
+    # errors that point at the account (logged out, no rights, blocked) rather than at the song
+    if isinstance(error, DeezerMediaException):
+        return error.account
+    return isinstance(error, Deezer403Exception)
 
-    try:
-        song, url, extension = get_song_url(song, song_quality)
-    except Exception as e:
-        raise RuntimeError(f"Failed to get song URL: {e}")
 
-    if not url:
-        print("ERROR: Can not download this song. Failed to get url.")
-        return output_file
+class DeezerAccount:
+    """ one account of a DeezerAccountPool and its bookkeeping """
+    def __init__(self, name, client, cap):
+        self.name = name
+        self.client = client
+        self.cap = cap
+        self.active = 0
+        self.failures = 0
+        self.benched_until = 0.0
 
-    key = calcbfkey(song["SNG_ID"])
-    try:
-        file_name = output_file.replace('.mp3', f'.{extension.lower()}')
+
+class DeezerAccountPool:
+    """
+    Spreads work over several Deezer accounts, each logged in with its own DeezerClient.
+    At most per_account operations run on an account at once. An account that fails max_failures
+    times in a row with account errors (403s, media errors) is benched for bench_time seconds,
+    new work then goes to the other accounts.
+    """
+    def __init__(self, arls, proxy_server="", per_account=4, pool_size=None, max_failures=3, bench_time=300):
+        self.max_failures = max_failures
+        self.bench_time = bench_time
+        self.cond = threading.Condition()
+        self.closed = False
+        self.accounts = []
+        for index, arl in enumerate(arls):
+            name = f"account {index + 1}"
+            try:
+                client = DeezerClient(arl, proxy_server, pool_size or per_account * 2)
+            except Exception as e:
+                print(f"Could not log in with {name}: {e}")
+                continue
+            if not client.license_token:
+                print(f"Could not log in with {name}, check its ARL")
+                continue
+            self.accounts.append(DeezerAccount(name, client, max(1, per_account)))
+        if not self.accounts:
+            raise Deezer403Exception("ERROR: none of the Deezer accounts could log in. Please update the ARL")
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def _account(self, client):
+        return next(account for account in self.accounts if account.client is client)
+
+    def available(self):
+        # clients of the accounts that aren't benched, all of them if every account is
+        with self.cond:
+            now = time.monotonic()
+            clients = [account.client for account in self.accounts if account.benched_until <= now]
+            return clients or [account.client for account in self.accounts]
+
+    def acquire(self, client=None, exclude=()):
+        # take a slot on client, or on the least busy account that isn't benched or excluded
+        # a given client is used even when benched, its songs can't move to another account
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise RuntimeError("Deezer account pool is closed")
+                now = time.monotonic()
+                if client is not None:
+                    candidates = [self._account(client)]
+                else:
+                    candidates = [account for account in self.accounts
+                                  if account.benched_until <= now and account.client not in exclude] \
+                        or [account for account in self.accounts if account.client not in exclude] \
+                        or self.accounts
+                free = [account for account in candidates if account.active < account.cap]
+                if free:
+                    account = min(free, key=lambda account: account.active / account.cap)
+                    account.active += 1
+                    return account.client
+                self.cond.wait()
+
+    def release(self, client, error=None):
+        # error: what the operation failed with, None on success
+        with self.cond:
+            self._account(client).active -= 1
+            self.cond.notify_all()
+        self.report(client, error)
+
+    def report(self, client, error=None):
+        # count an operation's outcome toward benching the account
+        with self.cond:
+            account = self._account(client)
+            if error is None:
+                account.failures = 0
+                return
+            if not is_account_error(error):
+                return
+            account.failures += 1
+            if account.failures >= self.max_failures:
+                account.failures = 0
+                account.benched_until = time.monotonic() + self.bench_time
+                print(f"Benching Deezer {account.name} for {self.bench_time} seconds: {error}")
+
+    @contextmanager
+    def use(self, client=None, exclude=()):
+        client = self.acquire(client, exclude)
         try:
-            with requests.get(url, stream=True) as response:
-                response.raise_for_status()
-                with open(file_name, "w+b") as fo:
-                    # Add song cover and first 30 seconds of unencrypted data
-                    writeid3v2(fo, song)
-                    decryptfile(response, key, fo)
-                    writeid3v1_1(fo, song)
-        except requests.exceptions.RequestException as e:
-            raise RuntimeError(f"Download failed: {e}")
+            yield client
+        except Exception as e:
+            self.release(client, e)
+            raise
+        self.release(client)
 
-    except Exception as e:
-        raise
-    else:
-        print("Dowload finished: {}".format(output_file))
+    def close(self):
+        # wakes up and fails every acquire waiting for a slot
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
 
 
-def get_song_infos_from_deezer_website(search_type, id):
-    # search_type: either one of the constants: TYPE_TRACK|TYPE_ALBUM|TYPE_PLAYLIST
-    # id: deezer_id of the song/album/playlist (like https://www.deezer.com/de/track/823267272)
-    # return: if TYPE_TRACK => song (dict grabbed from the website with information about a song)
-    # return: if TYPE_ALBUM|TYPE_PLAYLIST => list of songs
-    # raises
-    # Deezer404Exception if
-    # 1. open playlist https://www.deezer.com/de/playlist/1180748301 and click on song Honey from Moby in a new tab:
-    # 2. Deezer gives you a 404: https://www.deezer.com/de/track/68925038
-    # Deezer403Exception if we are not logged in
-
-    url = "https://www.deezer.com/us/{}/{}".format(search_type, id)
-    resp = session.get(url)
-    if resp.status_code == 404:
-        raise Deezer404Exception("ERROR: Got a 404 for {} from Deezer".format(url))
-    if "MD5_ORIGIN" not in resp.text:
-        raise Deezer403Exception("ERROR: we are not logged in on deezer.com. Please update the cookie")
-
-    parser = ScriptExtractor()
-    parser.feed(resp.text)
-    parser.close()
-
-    songs = []
-    for script in parser.scripts:
-        regex = re.search(r'{"DATA":.*', script)
-        if regex:
-            DZR_APP_STATE = json.loads(regex.group())
-            global album_Data
-            album_Data = DZR_APP_STATE.get("DATA")
-            if DZR_APP_STATE['DATA']['__TYPE__'] == 'playlist' or DZR_APP_STATE['DATA']['__TYPE__'] == 'album':
-                # songs if you searched for album/playlist
-                for song in DZR_APP_STATE['SONGS']['data']:
-                    songs.append(song)
-            elif DZR_APP_STATE['DATA']['__TYPE__'] == 'song':
-                # just one song on that page
-                songs.append(DZR_APP_STATE['DATA'])
-    return songs[0] if search_type == TYPE_TRACK else songs
+# the module level functions below use a default client, set up by init_deezer_session
+_default_client = None
+_default_client_lock = threading.Lock()
 
 
-def deezer_search(search, search_type):
-    # search: string (What are you looking for?)
-    # search_type: either one of the constants: TYPE_TRACK|TYPE_ALBUM|TYPE_ALBUM_TRACK (TYPE_PLAYLIST is not supported)
-    # return: list of dicts (keys depend on search_type)
-
-    if search_type not in [TYPE_TRACK, TYPE_ALBUM, TYPE_ALBUM_TRACK]:
-        print("ERROR: search_type is wrong: {}".format(search_type))
-        return []
-    search = urllib.parse.quote_plus(search)
-    if search_type == TYPE_ALBUM_TRACK:
-        resp = get_song_infos_from_deezer_website(TYPE_ALBUM, search)
-    else:
-        resp = session.get("https://api.deezer.com/search/{}?q={}".format(search_type, search)).json()['data']
-    return_nice = []
-    for item in resp:
-        i = {}
-        if search_type == TYPE_ALBUM:
-            i['id'] = str(item['id'])
-            i['id_type'] = TYPE_ALBUM
-            i['album'] = item['title']
-            i['album_id'] = item['id']
-            i['img_url'] = item['cover_small']
-            i['artist'] = item['artist']['name']
-            i['title'] = ''
-            i['preview_url'] = ''
-
-        if search_type == TYPE_TRACK:
-            i['id'] = str(item['id'])
-            i['id_type'] = TYPE_TRACK
-            i['title'] = item['title']
-            i['img_url'] = item['album']['cover_small']
-            i['album'] = item['album']['title']
-            i['album_id'] = item['album']['id']
-            i['artist'] = item['artist']['name']
-            i['preview_url'] = item['preview']
+def init_deezer_session(proxy_server, pool_size=10, arl=None):
+    # replace the default client with one logged in with arl (config's cookie_arl if None)
+    global _default_client
+    client = DeezerClient(arl if arl is not None else config['deezer']['cookie_arl'], proxy_server, pool_size)
+    with _default_client_lock:
+        _default_client = client
+    return client
 
-        if search_type == TYPE_ALBUM_TRACK:
-            i['id'] = str(item['SNG_ID'])
-            i['id_type'] = TYPE_TRACK
-            i['title'] = item['SNG_TITLE']
-            i['img_url'] = '' # item['album']['cover_small']
-            i['album'] = item['ALB_TITLE']
-            i['album_id'] = item['ALB_ID']
-            i['artist'] = item['ART_NAME']
-            i['preview_url'] = next(media['HREF'] for media in item['MEDIA'] if media['TYPE'] == 'preview')
 
-        return_nice.append(i)
-    return return_nice
+def get_default_client():
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = DeezerClient(config.get('deezer', 'cookie_arl', fallback=''))
+        return _default_client
 
 
-def parse_deezer_playlist(playlist_id):
-    # playlist_id: id of the playlist or the url of it
-    # e.g. https://www.deezer.com/de/playlist/6046721604 or 6046721604
-    # return (playlist_name, list of songs) (song is a dict with information about the song)
-    # raises DeezerApiException if something with the Deezer API is broken
+def get_user_data():
+    return get_default_client().get_user_data()
 
-    try:
-        playlist_id = re.search(r'\d+', playlist_id).group(0)
-    except AttributeError:
-        raise DeezerApiException("ERROR: Regex (\\d+) for playlist_id failed. You gave me '{}'".format(playlist_id))
 
-    url_get_csrf_token = "https://www.deezer.com/ajax/gw-light.php?method=deezer.getUserData&input=3&api_version=1.0&api_token="
-    req = session.post(url_get_csrf_token)
-    csrf_token = req.json()['results']['checkForm']
+def downloadpicture(pic_idid):
+    return get_default_client().downloadpicture(pic_idid)
 
-    url_get_playlist_songs = "https://www.deezer.com/ajax/gw-light.php?method=deezer.pagePlaylist&input=3&api_version=1.0&api_token={}".format(csrf_token)
-    data = {'playlist_id': int(playlist_id),
-            'start': 0,
-            'tab': 0,
-            'header': True,
-            'lang': 'de',
-            'nb': 500}
-    req = session.post(url_get_playlist_songs, json=data)
-    json = req.json()
 
-    if len(json['error']) > 0:
-        raise DeezerApiException("ERROR: deezer api said {}".format(json['error']))
-    json_data = json['results']
+def prefetch_picture(pic_idid):
+    return get_default_client().prefetch_picture(pic_idid)
 
-    playlist_name = json_data['DATA']['TITLE']
-    number_songs = json_data['DATA']['NB_SONG']
-    print("Playlist '{}' has {} songs".format(playlist_name, number_songs))
 
-    print("Got {} songs from API".format(json_data['SONGS']['count']))
-    return playlist_name, json_data['SONGS']['data']
+def get_song_url(song, quality=3):
+    return get_default_client().get_song_url(song, quality)
 
 
-def get_deezer_favorites(user_id: str) -> Optional[Sequence[int]]:
-    if not user_id.isnumeric():
-        raise Exception(f"User id '{user_id}' must be numeric")
-    resp = session.get(f"https://api.deezer.com/user/{user_id}/tracks?limit=10000000000")
-    assert resp.status_code == 200, f"got invalid status asking for favorite song\n{resp.text}s"
-    resp_json = resp.json()
-    if "error" in resp_json.keys():
-        raise Exception(f"Upstream api error getting favorite songs for user {user_id}:\n{resp_json['error']}")
-    # check is set next
-    
-    while "next" in resp_json.keys():
-        resp = session.get(resp_json["next"])
-        assert resp.status_code == 200, f"got invalid status asking for favorite song\n{resp.text}s"
-        resp_json_next = resp.json()
-        if "error" in resp_json_next.keys():
-            raise Exception(f"Upstream api error getting favorite songs for user {user_id}:\n{resp_json_next['error']}")
-        resp_json["data"] += resp_json_next["data"]
+def get_song_urls(songs, quality=None, batch_size=MEDIA_URL_BATCH_SIZE):
+    return get_default_client().get_song_urls(songs, quality, batch_size)
+
+
+def transfer_song(song, url, file_name, tags=None, album=None, part_name=None):
+    return get_default_client().transfer_song(song, url, file_name, tags, album, part_name)
+
+
+def download_song(song, output_file, album=None):
+    return get_default_client().download_song(song, output_file, album)
+
+
+def gw_api_call(method, args=None):
+    return get_default_client().gw_api_call(method, args)
 
-        if "next" in resp_json_next.keys():
-            resp_json["next"] = resp_json_next["next"]
-        else:
-            del resp_json["next"]
- 
-    print(f"Got {resp_json['total']} favorite songs for user {user_id} from the api")
-    songs = [song['id'] for song in resp_json['data']]
-    return songs
+
+def get_songs_data(song_ids, batch_size=SONG_DATA_BATCH_SIZE):
+    return get_default_client().get_songs_data(song_ids, batch_size)
+
+
+def get_song_infos_from_deezer_website(search_type, id):
+    return get_default_client().get_song_infos_from_deezer_website(search_type, id)
+
+
+def get_song_infos_with_album(search_type, id):
+    return get_default_client().get_song_infos_with_album(search_type, id)
+
+
+def deezer_search(search, search_type):
+    return get_default_client().deezer_search(search, search_type)
+
+
+def parse_deezer_playlist(playlist_id):
+    return get_default_client().parse_deezer_playlist(playlist_id)
+
+
+def get_deezer_favorites(user_id: str) -> Optional[Sequence[int]]:
+    return get_default_client().get_deezer_favorites(user_id)
 
 
 def test_deezer_login():
-    print("Let's check if the deezer login is still working")
-    try:
-        song = get_song_infos_from_deezer_website(TYPE_TRACK, "917265")
-    except (Deezer403Exception, Deezer404Exception) as msg:
-        print(msg)
-        print("Login is not working anymore.")
-        return False
-
-    if song:
-        print("Login is still working.")
-        return True
-    else:
-        print("Login is not working anymore.")
-        return False
+    return get_default_client().test_deezer_login()
 
 
 if __name__ == '__main__':
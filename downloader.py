@@ -0,0 +1,655 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from deezer import DeezerAccountPool, split_arls, is_account_error, TYPE_TRACK, TYPE_ALBUM, MEDIA_URL_BATCH_SIZE, SONG_DATA_BATCH_SIZE
+from pipeline import Pipeline, PipelineStage
+from cache import IsrcCache, get_data_dir
+from library import LibraryIndex
+from jobstore import RESOLVED, TRANSFERRING, DONE, SKIPPED, FAILED, UNFINISHED_STATES
+
+# attempts per song transfer, every retry resumes from the transfer's journal
+TRANSFER_ATTEMPTS = 3
+# seconds an api.deezer.com ISRC lookup may stall before the track fails
+LOOKUP_TIMEOUT = 10
+
+def _lock_name(path):
+    # lock files live in the data directory, keyed by the output path, not next to the songs
+    folder = os.path.join(get_data_dir(), "locks")
+    os.makedirs(folder, exist_ok=True)
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(path)).encode("utf-8")).hexdigest()
+    return os.path.join(folder, key + ".lock")
+
+
+def claim_path(path):
+    # lock a file keyed by path so no other process writes path, the OS drops the lock if the
+    # process dies
+    # return the open lock file, None if another process holds it
+    lock_name = _lock_name(path)
+    while True:
+        f = open(lock_name, "a+b")
+        try:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return None
+        # the holder before us may have removed the file after we opened it, the lock is only
+        # worth something on the file that's still there
+        try:
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(lock_name)):
+                return f
+        except OSError:
+            pass
+        f.close()
+
+
+def release_claim(f):
+    lock_name = f.name
+    if not fcntl:
+        # Windows won't remove a file that is open, ours included
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+    try:
+        os.remove(lock_name)
+    except OSError:
+        # on Windows the file can't go while another process has it open, it's theirs then
+        pass
+    f.close()
+
+
+@dataclass
+class Track:
+    id: str
+    title: str
+    artists: str
+    album: str
+    track_number: int
+    duration_ms: int
+    release_date: str = ""
+
+@dataclass
+class DownloadJob:
+    index: int
+    track: Track
+    outpath: str = ""
+    full_path: str = ""
+    deezer_id: str = ""
+    song: dict = None
+    album: dict = None
+    url: str = ""
+    extension: str = ""
+    tags: tuple = None
+    client: object = None
+    reassigned: bool = False
+    store_index: int = None
+
+
+def tracks_from_metadata(url_type, metadata):
+    # turn get_filtered_data's result for a url of url_type into (tracks, name, kind),
+    # kind is "track", "album" or "playlist" (artist discographies download like playlists)
+    if url_type == "track":
+        track_data = metadata["track"]
+        track = Track(
+            id=track_data["isrc"],
+            title=track_data["name"],
+            artists=track_data["artists"],
+            album=track_data["album_name"],
+            track_number=1,
+            duration_ms=track_data.get("duration_ms", 0),
+            release_date=track_data.get("release_date", "")
+        )
+        return [track], f"{track.title} - {track.artists}", "track"
+
+    if url_type == "album":
+        name = metadata["album_info"]["name"]
+        kind = "album"
+    elif url_type == "playlist":
+        name = metadata["playlist_info"]["owner"]["name"]
+        kind = "playlist"
+    elif url_type == "artist_discography":
+        artist_info = metadata["artist_info"]
+        name = f"{artist_info['name']} - Discography ({artist_info['discography_type'].title()})"
+        kind = "playlist"
+    else:
+        raise ValueError(f"Nothing to download for a {url_type} url")
+
+    tracks = []
+    for track in metadata["track_list"]:
+        if url_type == "album":
+            album, track_number = name, track["track_number"]
+        elif url_type == "playlist":
+            album, track_number = track["album_name"], len(tracks) + 1
+        else:
+            album, track_number = track["album_name"], track.get("track_number", len(tracks) + 1)
+        tracks.append(Track(
+            id=track.get("isrc", ""),
+            title=track["name"],
+            artists=track["artists"],
+            album=album,
+            track_number=track_number,
+            duration_ms=track.get("duration_ms", 0),
+            release_date=track.get("release_date", "")
+        ))
+    return tracks, name, kind
+
+
+def output_folder(outpath, name):
+    # albums and playlists go to a folder of their own under outpath
+    folder_name = re.sub(r'[<>:"/\\|?*]', '_', name)
+    outpath = os.path.join(outpath, folder_name)
+    os.makedirs(outpath, exist_ok=True)
+    return outpath
+
+
+class Downloader:
+    """
+    Downloads Spotify tracks from Deezer by ISRC through a Pipeline of lookup, tagging and transfer
+    stages. Qt-free, the GUI's DownloadWorker and the command line both drive it.
+    on_progress(message, percent) gets the log lines, on_track(status, job, error) is called once per
+    track with status "done", "skipped" or "failed".
+    With a JobStore, the job and the state of each of its tracks are recorded as they change,
+    see from_store to resume it.
+    Tracks whose ISRC is already in the LibraryIndex somewhere under library_root (outpath by
+    default) are skipped before anything is looked up.
+    """
+    def __init__(self, tracks, outpath, arl, is_single_track=False, is_album=False, is_playlist=False, 
+                 album_or_playlist_name='', filename_format='title_artist', use_track_numbers=True,
+                 use_album_subfolders=False, use_artist_subfolders=False, max_workers=4,
+                 on_progress=None, on_track=None, store=None, url='', job_id=None, indices=None, accounts=None,
+                 library=None, library_root=None):
+        self.tracks = tracks
+        self.outpath = outpath
+        self.arl = arl
+        self.is_single_track = is_single_track
+        self.is_album = is_album
+        self.is_playlist = is_playlist
+        self.album_or_playlist_name = album_or_playlist_name
+        self.filename_format = filename_format
+        self.use_track_numbers = use_track_numbers
+        self.use_album_subfolders = use_album_subfolders
+        self.use_artist_subfolders = use_artist_subfolders
+        self.max_workers = max(1, int(max_workers))
+        self.on_progress = on_progress or (lambda message, percent: None)
+        self.on_track = on_track or (lambda status, job, error: None)
+        self.store = store
+        self.url = url
+        self.job_id = job_id
+        # the tracks' indices in the stored job, a resumed job only runs some of them
+        self.indices = indices if indices is not None else list(range(len(tracks)))
+        self.is_paused = False
+        self.is_stopped = False
+        self.failed_tracks = []
+        self.completed_tracks = 0
+        self.lock = threading.Lock()
+        self.isrc_cache = IsrcCache()
+        # ISRC lookups reuse their connections to api.deezer.com, one per resolve worker
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(2, self.max_workers)))
+        self.album_songs = {}
+        self.album_data = None
+        # output path -> claim_path lock file of the tracks being worked on
+        self.active_paths = {}
+        self.album_client = None
+        # every account gets a client of its own, so another job's session is never touched
+        # arl: one ARL, several separated by commas, or a list of them
+        # accounts: a DeezerAccountPool to share with other downloaders instead, stop leaves it open
+        self.library = library or LibraryIndex()
+        self.library_root = library_root or outpath
+        self.owns_accounts = accounts is None
+        self.accounts = accounts or DeezerAccountPool(
+            split_arls(self.arl) if isinstance(self.arl, str) else list(self.arl),
+            per_account=self.max_workers, pool_size=self.max_workers * 2)
+
+    @classmethod
+    def from_store(cls, store, job_id, arl, states=UNFINISHED_STATES, **kwargs):
+        # a Downloader for the tracks of a stored job that are in states
+        job = store.get_job(job_id)
+        if job is None:
+            raise ValueError(f"No download job {job_id}")
+        rows = store.job_tracks(job_id, states)
+        tracks = [Track(row["isrc"], row["title"], row["artists"], row["album"], row["track_number"],
+                        row["duration_ms"], row["release_date"]) for row in rows]
+        options = {**job["options"], **kwargs}
+        return cls(tracks, job["outpath"], arl, album_or_playlist_name=job["name"], store=store, url=job["url"],
+                   job_id=job_id, indices=[row["idx"] for row in rows], **options)
+
+    def options(self):
+        # what from_store needs to run the job the same way again
+        return {
+            "is_single_track": self.is_single_track,
+            "is_album": self.is_album,
+            "is_playlist": self.is_playlist,
+            "filename_format": self.filename_format,
+            "use_track_numbers": self.use_track_numbers,
+            "use_album_subfolders": self.use_album_subfolders,
+            "use_artist_subfolders": self.use_artist_subfolders,
+            "max_workers": self.max_workers,
+            "library_root": self.library_root,
+        }
+
+    def set_state(self, job, state, error=None):
+        if self.store is not None:
+            self.store.set_track_state(self.job_id, job.store_index, state, error, job.full_path, job.deezer_id or None)
+
+    def get_formatted_filename(self, track):
+        if self.filename_format == "artist_title":
+            filename = f"{track.artists} - {track.title}.mp3"
+        elif self.filename_format == "title_only":
+            filename = f"{track.title}.mp3"
+        else:
+            filename = f"{track.title} - {track.artists}.mp3"
+        filename = re.sub(r'[<>:"/\\|?*]', lambda m: "'" if m.group() == '"' else '_', filename)
+        return filename
+
+    def run(self):
+        # return (success, message, failed tracks), None if stopped
+        try:
+            self.total_tracks = len(self.tracks)
+            if self.store is not None and self.job_id is None:
+                self.job_id = self.store.create_job(self.url, self.album_or_playlist_name, self.outpath,
+                                                    self.options(), self.tracks)
+            self.scan_library()
+            if self.is_album and self.total_tracks > 1:
+                self.prefetch_album()
+            
+            self.pipeline = Pipeline(
+                self.build_stages(),
+                on_done=self.on_track_done,
+                on_error=self.on_track_error,
+                should_stop=lambda: self.is_stopped,
+                wait_if_paused=self.wait_if_paused,
+                on_stats=self.report_stats
+            )
+            self.pipeline.run(DownloadJob(i, track, store_index=self.indices[i]) for i, track in enumerate(self.tracks))
+            # tracks dropped by a stop never reach on_track_done/on_track_error
+            with self.lock:
+                claims, self.active_paths = list(self.active_paths.values()), {}
+            for claim in claims:
+                if claim is not None:
+                    release_claim(claim)
+            if self.store is not None:
+                self.update_job_status()
+
+            if not self.is_stopped:
+                self.report_stats(self.pipeline.stats())
+                success_message = "Download completed!"
+                if self.failed_tracks:
+                    success_message += f"\n\nFailed downloads: {len(self.failed_tracks)} tracks"
+                return True, success_message, self.failed_tracks
+                
+        except Exception as e:
+            return False, str(e), self.failed_tracks
+
+    def update_job_status(self):
+        # this downloader may run only part of the job, the job is finished once no track is left,
+        # a resumed job also counts the failures of its earlier runs
+        if self.is_stopped:
+            status = "stopped"
+        elif self.store.job_tracks(self.job_id, UNFINISHED_STATES):
+            status = "running"
+        else:
+            status = "failed" if self.store.job_tracks(self.job_id, (FAILED,)) else "done"
+        self.store.set_job_status(self.job_id, status)
+
+    def scan_library(self):
+        if not os.path.isdir(self.library_root):
+            return
+        try:
+            read = self.library.scan(self.library_root)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not scan {self.library_root}: {e}")
+            return
+        if read:
+            self.on_progress(f"Indexed {read} files in {self.library_root}", 0)
+
+    def prefetch_album(self):
+        # one deezer album page holds every song of the album, so match the tracks by ISRC locally
+        # tracks that are already in the library need nothing from deezer
+        candidates = [track for track in self.tracks if track.id and not self.library.find(track.id, self.library_root)]
+        for track in candidates[:3]:
+            if self.is_stopped:
+                return
+            try:
+                # the cache knows the album of every track of an album synced before
+                album_id = self.isrc_cache.get_album(track.id)
+                if not album_id:
+                    if self.isrc_cache.get(track.id) == (True, None):
+                        continue
+                    track_data = self.get_isrc_track(track.id)
+                    album_id = (track_data.get("album") or {}).get("id")
+                    if not album_id:
+                        continue
+                    self.isrc_cache.put(track.id, track_data.get("id"), album_id)
+                with self.accounts.use() as client:
+                    songs, album_data = client.get_song_infos_with_album(TYPE_ALBUM, album_id)
+            except Exception as e:
+                print(f"Album lookup failed for {track.id}: {e}")
+                continue
+
+            self.album_songs = {song["ISRC"]: song for song in songs if song.get("ISRC")}
+            self.album_data = album_data
+            self.album_client = client
+            if songs:
+                client.prefetch_picture(songs[0].get("ALB_PICTURE"))
+            for isrc, song in self.album_songs.items():
+                self.isrc_cache.put(isrc, song["SNG_ID"], song.get("ALB_ID") or album_id)
+
+            matched = sum(1 for t in self.tracks if t.id in self.album_songs)
+            self.on_progress(f"Matched {matched}/{self.total_tracks} tracks with Deezer album {album_id}", 0)
+            return
+
+    def build_stages(self):
+        # metadata stages run ahead of the transfers so the transfer workers never wait on lookups
+        lookahead = max(2, self.max_workers // 2)
+        queue_size = self.max_workers * 2
+        return [
+            PipelineStage("resolve", self.resolve_track, lookahead, queue_size),
+            PipelineStage("song info", self.fetch_song_infos, lookahead, SONG_DATA_BATCH_SIZE * 2,
+                          batch_size=SONG_DATA_BATCH_SIZE),
+            PipelineStage("media url", self.fetch_media_urls, 1, MEDIA_URL_BATCH_SIZE * 2,
+                          batch_size=1 if self.is_single_track else MEDIA_URL_BATCH_SIZE),
+            PipelineStage("tag", self.build_tags, lookahead, queue_size),
+            PipelineStage("transfer", self.transfer_track, self.max_workers * len(self.accounts), queue_size),
+        ]
+
+    def wait_if_paused(self):
+        while self.is_paused:
+            if self.is_stopped:
+                return False
+            time.sleep(0.1)
+        return not self.is_stopped
+
+    def get_percentage(self):
+        with self.lock:
+            return int(self.completed_tracks / self.total_tracks * 100)
+
+    def complete_track(self):
+        with self.lock:
+            self.completed_tracks += 1
+            return int(self.completed_tracks / self.total_tracks * 100)
+
+    def release_path(self, job):
+        with self.lock:
+            claim = self.active_paths.pop(job.full_path, None)
+        if claim is not None:
+            release_claim(claim)
+
+    def on_track_done(self, job):
+        self.release_path(job)
+        self.library.add(job.full_path, job.track.id)
+        track = job.track
+        self.on_progress(f"Successfully downloaded: {track.title} - {track.artists}", self.complete_track())
+        self.set_state(job, DONE)
+        self.on_track("done", job, None)
+
+    def on_track_error(self, job, error):
+        self.release_path(job)
+        track = job.track
+        if str(error) == "File already exists":
+            self.on_progress(f"Skipped (File exists): {track.title} - {track.artists}", self.complete_track())
+            self.set_state(job, SKIPPED)
+            self.on_track("skipped", job, None)
+            return
+        if str(error).startswith("Already in library"):
+            self.on_progress(f"Skipped (In library: {job.full_path}): {track.title} - {track.artists}",
+                             self.complete_track())
+            self.set_state(job, SKIPPED)
+            self.on_track("skipped", job, None)
+            return
+        if self.is_stopped:
+            # stop closes the account pool and fails whatever is in flight, those tracks stay
+            # unfinished in the job store so a resume picks them up
+            return
+        error = f"Download failed: {str(error)}"
+        with self.lock:
+            self.failed_tracks.append((track.title, track.artists, error))
+        self.on_progress(f"Failed to download: {track.title} - {track.artists}\nError: {error}", 
+                         self.complete_track())
+        self.set_state(job, FAILED, error)
+        self.on_track("failed", job, error)
+
+    def report_stats(self, stats):
+        summary = " | ".join(
+            f"{stage['name']}: queue {stage['queue']}, {stage['throughput']:.2f}/s" for stage in stats
+        )
+        self.on_progress(f"Pipeline: {summary}", 0)
+
+    def resolve_track(self, job):
+        track = job.track
+        self.on_progress(f"Starting download ({job.index+1}/{self.total_tracks}): {track.title} - {track.artists}", 
+                        self.get_percentage())
+
+        owned = self.library.find(track.id, self.library_root)
+        if owned:
+            job.full_path = owned
+            raise Exception(f"Already in library: {owned}")
+
+        outpath = self.outpath
+        if self.is_playlist:
+            if self.use_artist_subfolders:
+                artist_name = track.artists.split(', ')[0] if ', ' in track.artists else track.artists
+                artist_folder = re.sub(r'[<>:"/\\|?*]', lambda m: "'" if m.group() == '"' else '_', artist_name)
+                outpath = os.path.join(outpath, artist_folder)
+            
+            if self.use_album_subfolders:
+                album_folder = re.sub(r'[<>:"/\\|?*]', lambda m: "'" if m.group() == '"' else '_', track.album)
+                outpath = os.path.join(outpath, album_folder)
+            
+            os.makedirs(outpath, exist_ok=True)
+
+        if (self.is_album or (self.is_playlist and (self.use_artist_subfolders or self.use_album_subfolders))) and self.use_track_numbers:
+            filename = f"{track.track_number:02d} - {self.get_formatted_filename(track)}"
+        else:
+            filename = self.get_formatted_filename(track)
+        
+        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+        full_path = os.path.join(outpath, filename)
+
+        if os.path.exists(full_path):
+            raise Exception("File already exists")
+
+        # the same track twice in one job would share a partial file, in this process or in
+        # another worker process of the same job
+        with self.lock:
+            if full_path in self.active_paths:
+                raise Exception("File already exists")
+            self.active_paths[full_path] = None
+        claim = claim_path(full_path)
+        if claim is None or os.path.exists(full_path):
+            with self.lock:
+                del self.active_paths[full_path]
+            if claim is not None:
+                release_claim(claim)
+            raise Exception("File already exists")
+        with self.lock:
+            self.active_paths[full_path] = claim
+        job.outpath = outpath
+        job.full_path = full_path
+
+        song = self.album_songs.get(track.id) if track.id else None
+        if song:
+            job.album, job.deezer_id = self.album_data, song["SNG_ID"]
+            # track tokens belong to the account that fetched them, with several accounts
+            # the song is fetched again by the account the track gets
+            if len(self.accounts) == 1:
+                job.song, job.client = song, self.album_client
+        else:
+            job.deezer_id = self.lookup_deezer_id(track.id)
+        self.set_state(job, RESOLVED)
+        return job
+
+    def get_isrc_track(self, isrc):
+        return self.session.get(f"https://api.deezer.com/2.0/track/isrc:{isrc}", timeout=LOOKUP_TIMEOUT).json()
+
+    def lookup_deezer_id(self, isrc):
+        found, deezer_id = self.isrc_cache.get(isrc) if isrc else (False, None)
+        if found:
+            if not deezer_id:
+                raise Exception("Failed to find track on Deezer")
+            return deezer_id
+
+        track_data = self.get_isrc_track(isrc)
+        
+        if "error" in track_data:
+            # 800 is deezer's "no data", anything else (quota, outage) is worth retrying later
+            if isrc and track_data["error"].get("code") == 800:
+                self.isrc_cache.put(isrc, None)
+            raise Exception("Failed to find track on Deezer")
+        
+        deezer_id = track_data.get("id")
+        if not deezer_id:
+            raise Exception("Could not find track ID on Deezer")
+        self.isrc_cache.put(isrc, deezer_id, (track_data.get("album") or {}).get("id"))
+        return deezer_id
+
+    def fetch_song_info(self, job):
+        with self.accounts.use(job.client):
+            job.song, job.album = job.client.get_song_infos_with_album(TYPE_TRACK, job.deezer_id)
+        if not job.song:
+            raise Exception("Could not get song information from Deezer")
+        return job
+
+    def fetch_song_infos(self, jobs, exclude=()):
+        # songs not matched from the album page are spread over the accounts,
+        # each account fetches its share with one bulk call
+        pending = [job for job in jobs if not job.song]
+        clients = [client for client in self.accounts.available() if client not in exclude] \
+            or self.accounts.available()
+        for offset, client in enumerate(clients):
+            group = pending[offset::len(clients)]
+            if not group:
+                continue
+            try:
+                with self.accounts.use(client):
+                    songs = client.get_songs_data([job.deezer_id for job in group])
+            except Exception as e:
+                print(f"Bulk song data fetch failed, falling back to track pages: {e}")
+                songs = {}
+            for job in group:
+                job.client = client
+                job.song = songs.get(str(job.deezer_id))
+                if job.song and job.album is None:
+                    # like the track page's DATA, the song data carries the release dates used for tagging
+                    job.album = job.song
+
+        results = []
+        for job in jobs:
+            if job.song:
+                results.append(job)
+                continue
+            try:
+                results.append(self.fetch_song_info(job))
+            except Exception as e:
+                results.append(e)
+
+        # the first track of each album starts loading the cover while its media url is fetched
+        for job in results:
+            if isinstance(job, DownloadJob):
+                job.client.prefetch_picture(job.song.get("ALB_PICTURE"))
+        return results
+
+    def fetch_media_urls(self, jobs):
+        # track tokens only work with the license token of their own account, so urls are
+        # requested per account
+        groups = {}
+        for job in jobs:
+            groups.setdefault(job.client, []).append(job)
+
+        results = {}
+        reassign = []
+        failed_clients = set()
+        for client, group in groups.items():
+            self.accounts.acquire(client)
+            try:
+                urls = client.get_song_urls([job.song for job in group])
+            except Exception as e:
+                urls = [(job.song, None, None, e) for job in group]
+
+            account_error = None
+            succeeded = False
+            for job, (song, url, extension, error) in zip(group, urls):
+                if error or not url:
+                    account = is_account_error(error)
+                    if account:
+                        # the pool tells account errors by their type, hand it the original
+                        account_error = error
+                    error = RuntimeError(f"Failed to get song URL: {error or 'no url'}")
+                    if account:
+                        # tried once more on another account
+                        if len(self.accounts) > 1 and not job.reassigned:
+                            reassign.append(job)
+                            continue
+                    results[id(job)] = error
+                    continue
+                job.song, job.url, job.extension = song, url, extension
+                results[id(job)] = job
+                succeeded = True
+            # a batch where nothing worked counts against the account
+            self.accounts.release(client, None if succeeded else account_error)
+            if not succeeded and account_error:
+                failed_clients.add(client)
+
+        if reassign:
+            for job in reassign:
+                job.reassigned, job.song, job.client = True, None, None
+            ready = []
+            for job, result in zip(reassign, self.fetch_song_infos(reassign, exclude=failed_clients)):
+                if isinstance(result, Exception):
+                    results[id(job)] = result
+                else:
+                    ready.append(job)
+            if ready:
+                for job, result in zip(ready, self.fetch_media_urls(ready)):
+                    results[id(job)] = result
+
+        return [results[id(job)] for job in jobs]
+
+    def build_tags(self, job):
+        job.tags = job.client.make_id3_tags(job.song, job.album)
+        return job
+
+    def transfer_track(self, job):
+        # transfer_song keeps a journal next to the partial file, so a retry resumes where it broke off
+        # the transfer counts toward the concurrency cap of the account the song belongs to
+        self.set_state(job, TRANSFERRING)
+        for attempt in range(1, TRANSFER_ATTEMPTS + 1):
+            try:
+                with self.accounts.use(job.client):
+                    job.client.transfer_song(job.song, job.url, job.full_path, job.tags)
+                return job
+            except RuntimeError as e:
+                if attempt == TRANSFER_ATTEMPTS or self.is_stopped:
+                    raise
+                self.on_progress(f"Resuming ({attempt}/{TRANSFER_ATTEMPTS - 1}): {job.track.title} - {job.track.artists}\nError: {str(e)}", 0)
+
+    def pause(self):
+        self.is_paused = True
+        self.on_progress("Download process paused.", 0)
+
+    def resume(self):
+        self.is_paused = False
+        self.on_progress("Download process resumed.", 0)
+
+    def stop(self): 
+        self.is_stopped = True
+        self.is_paused = False
+        if self.owns_accounts:
+            self.accounts.close()
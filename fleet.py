@@ -0,0 +1,387 @@
+"""
+Downloads spread over several worker processes, for bulk runs a single process can't keep busy.
+
+The coordinator records each url as a job in the JobStore and puts one work item per track in a
+WorkQueue. Worker processes lease items in batches and renew their leases while they work on
+them; the items of a worker that dies are leased again by another one once its leases expire.
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from cache import get_data_dir
+from deezer import DeezerAccountPool, split_arls
+from downloader import Downloader, Track, tracks_from_metadata, output_folder
+from getMetadata import get_filtered_data, parse_uri
+from jobstore import JobStore, UNFINISHED_STATES
+from library import LibraryIndex
+
+# states of a work item before it finishes as "done", "skipped" or "failed"
+QUEUED = "queued"
+LEASED = "leased"
+
+
+class WorkQueue:
+    """
+    SQLite table of work items shared by the processes of a run.
+    An item is leased to one worker for lease_time seconds at a time, an item whose lease expired
+    goes to the next worker asking for work, until it has been leased max_attempts times.
+    """
+    def __init__(self, path=None, max_attempts=3):
+        self.path = path or os.path.join(get_data_dir(), "fleet.sqlite3")
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # autocommit, lease opens its own write transaction
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS work ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " run TEXT NOT NULL,"
+                " job_id INTEGER NOT NULL,"
+                " idx INTEGER NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " worker TEXT,"
+                " lease_until REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " finished_seq INTEGER)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS work_state ON work (run, state)")
+
+    def put(self, run, job_id, items):
+        # items: (index in the job, payload dict) pairs
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO work (run, job_id, idx, payload, state) VALUES (?, ?, ?, ?, ?)",
+                    [(run, job_id, index, json.dumps(payload), QUEUED) for index, payload in items]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def lease(self, run, worker, limit, lease_time):
+        # lease up to limit items of a single job, returns them as dicts
+        # items that were leased max_attempts times without finishing are failed instead
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "UPDATE work SET state = 'failed', error = 'Worker lost the track too many times',"
+                    " finished_seq = (SELECT COALESCE(MAX(finished_seq), 0) + 1 FROM work)"
+                    " WHERE run = ? AND state = ? AND lease_until < ? AND attempts >= ?",
+                    (run, LEASED, now, self.max_attempts)
+                )
+                available = "run = ? AND (state = ? OR (state = ? AND lease_until < ?))"
+                params = (run, QUEUED, LEASED, now)
+                first = self.conn.execute(
+                    f"SELECT job_id FROM work WHERE {available} ORDER BY id LIMIT 1", params
+                ).fetchone()
+                rows = []
+                if first:
+                    rows = self.conn.execute(
+                        f"SELECT * FROM work WHERE {available} AND job_id = ? ORDER BY id LIMIT ?",
+                        (*params, first["job_id"], limit)
+                    ).fetchall()
+                    self.conn.executemany(
+                        "UPDATE work SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1"
+                        " WHERE id = ?",
+                        [(LEASED, worker, now + lease_time, row["id"]) for row in rows]
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["payload"] = json.loads(item["payload"])
+            items.append(item)
+        return items
+
+    def renew(self, worker, lease_time):
+        # extend every lease the worker holds
+        with self.lock:
+            self.conn.execute("UPDATE work SET lease_until = ? WHERE worker = ? AND state = ?",
+                              (time.time() + lease_time, worker, LEASED))
+
+    def finish(self, item_id, worker, state, error=None):
+        # returns False if the lease was lost, the item then belongs to another worker
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE work SET state = ?, error = ?, lease_until = NULL,"
+                " finished_seq = (SELECT COALESCE(MAX(finished_seq), 0) + 1 FROM work)"
+                " WHERE id = ? AND worker = ? AND state = ?",
+                (state, error, item_id, worker, LEASED)
+            ).rowcount > 0
+
+    def release(self, worker):
+        # hand the worker's leased items back, for a worker that stops before finishing them
+        with self.lock:
+            self.conn.execute("UPDATE work SET state = ?, worker = NULL, lease_until = NULL,"
+                              " attempts = attempts - 1 WHERE worker = ? AND state = ?", (QUEUED, worker, LEASED))
+
+    def finished_since(self, run, seq):
+        # items of the run finished after finished_seq seq, in the order they finished
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM work WHERE run = ? AND finished_seq > ? ORDER BY finished_seq", (run, seq)
+            ).fetchall()
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["payload"] = json.loads(item["payload"])
+            items.append(item)
+        return items
+
+    def unfinished(self, run):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM work WHERE run = ? AND state IN (?, ?)", (run, QUEUED, LEASED)
+            ).fetchone()[0]
+
+    def clear(self, run):
+        # drop a run's items, its jobs stay in the JobStore
+        with self.lock:
+            self.conn.execute("DELETE FROM work WHERE run = ?", (run,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def run_worker(run, name, arl, queue_path=None, store_path=None, max_workers=4, lease_time=60,
+               stop_event=None, pause_event=None):
+    """ worker process: downloads leased items until the run has none left """
+    # the coordinator reports progress, the worker's own logs go to stderr
+    sys.stdout = sys.stderr
+    queue = WorkQueue(queue_path)
+    store = JobStore(store_path)
+    accounts = DeezerAccountPool(split_arls(arl) if isinstance(arl, str) else list(arl),
+                                 per_account=max_workers, pool_size=max_workers * 2)
+    # shared by the worker's downloaders, so the library is scanned once per process
+    library = LibraryIndex()
+    stop_event = stop_event or threading.Event()
+    pause_event = pause_event or threading.Event()
+    finished = threading.Event()
+    current = [None]
+
+    def heartbeat():
+        while not finished.wait(lease_time / 3):
+            queue.renew(name, lease_time)
+
+    def control():
+        # hands the coordinator's pause and stop to the running downloader
+        while not finished.wait(0.2):
+            downloader = current[0]
+            if downloader is None:
+                continue
+            if stop_event.is_set():
+                downloader.stop()
+            else:
+                downloader.is_paused = pause_event.is_set()
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    threading.Thread(target=control, daemon=True).start()
+    try:
+        while not stop_event.is_set():
+            items = queue.lease(run, name, max_workers * 4, lease_time)
+            if not items:
+                # what's left is leased by other workers, wait in case one of them dies
+                if not queue.unfinished(run):
+                    break
+                time.sleep(min(5, lease_time / 3))
+                continue
+
+            job = store.get_job(items[0]["job_id"])
+            by_index = {item["idx"]: item for item in items}
+
+            def on_track(status, download_job, error):
+                queue.finish(by_index.pop(download_job.store_index)["id"], name, status, error)
+
+            current[0] = downloader = Downloader(
+                [Track(**item["payload"]) for item in items], job["outpath"], arl,
+                album_or_playlist_name=job["name"], **job["options"], store=store, url=job["url"],
+                job_id=job["id"], indices=list(by_index), accounts=accounts, library=library,
+                on_track=on_track
+            )
+            result = downloader.run()
+            current[0] = None
+            if result is not None and not result[0]:
+                for item in list(by_index.values()):
+                    queue.finish(item["id"], name, "failed", result[1])
+            # a stopped downloader leaves its unfinished items to a later run
+            queue.release(name)
+    finally:
+        finished.set()
+        accounts.close()
+        queue.close()
+        store.close()
+
+
+class FleetCoordinator:
+    """
+    Runs the tracks of one or more jobs on `processes` worker processes and reports their
+    progress like a Downloader: on_progress(message, percent) and on_track(status, item, error),
+    where item is the work item dict with the track's fields in item["payload"].
+    """
+    def __init__(self, arl, processes=2, max_workers=4, lease_time=60, queue_path=None, store_path=None,
+                 on_progress=None, on_track=None, start_method="spawn", poll_interval=0.5):
+        self.arl = arl
+        self.processes = max(1, int(processes))
+        self.max_workers = max(1, int(max_workers))
+        self.lease_time = lease_time
+        self.queue_path = queue_path or os.path.join(get_data_dir(), "fleet.sqlite3")
+        self.store_path = store_path
+        self.on_progress = on_progress or (lambda message, percent: None)
+        self.on_track = on_track or (lambda status, item, error: None)
+        self.context = multiprocessing.get_context(start_method)
+        self.poll_interval = poll_interval
+        self.run_id = uuid.uuid4().hex
+        self.queue = WorkQueue(self.queue_path)
+        self.store = JobStore(store_path)
+        self.stop_event = self.context.Event()
+        self.pause_event = self.context.Event()
+        self.is_stopped = False
+        self.started_workers = 0
+        self.total_tracks = 0
+        self.job_ids = []
+
+    @property
+    def is_paused(self):
+        return self.pause_event.is_set()
+
+    def add_url(self, url, outpath, options, client=None):
+        # fetch url's tracks from Spotify and queue them as a new job, returns the job id
+        # options: the Downloader's filename and subfolder options
+        metadata = get_filtered_data(url, client=client)
+        if "error" in metadata:
+            raise ValueError(metadata["error"])
+        tracks, name, kind = tracks_from_metadata(parse_uri(url)["type"], metadata)
+        if kind != "track":
+            outpath = output_folder(outpath, name)
+        options = {**options, "is_single_track": kind == "track", "is_album": kind == "album",
+                   "is_playlist": kind == "playlist", "max_workers": self.max_workers}
+        return self.add_tracks(url, tracks, outpath, name, options)
+
+    def add_tracks(self, url, tracks, outpath, name, options):
+        # record a job for tracks and queue them, options are the Downloader's job options
+        job_id = self.store.create_job(url, name, outpath, options, tracks)
+        self.add_job(job_id)
+        return job_id
+
+    def add_job(self, job_id, states=None):
+        # queue the tracks of a stored job, its unfinished ones by default
+        rows = self.store.job_tracks(job_id, states or UNFINISHED_STATES)
+        fields = ("title", "artists", "album", "track_number", "duration_ms", "release_date")
+        self.queue.put(self.run_id, job_id, [
+            (row["idx"], {"id": row["isrc"], **{field: row[field] for field in fields}}) for row in rows
+        ])
+        self.job_ids.append(job_id)
+        self.total_tracks += len(rows)
+
+    def start_worker(self):
+        self.started_workers += 1
+        number = self.started_workers
+        process = self.context.Process(
+            target=run_worker, name=f"spotizer-worker-{number}",
+            args=(self.run_id, f"{os.getpid()}-{number}", self.arl, self.queue_path, self.store_path,
+                  self.max_workers, self.lease_time, self.stop_event, self.pause_event),
+            daemon=True
+        )
+        process.start()
+        return process
+
+    def run(self):
+        # return (success, message, failed tracks) like Downloader.run, None if stopped
+        if not self.total_tracks:
+            return True, "Nothing to download.", []
+        self.on_progress(f"Starting {self.processes} worker processes for {self.total_tracks} tracks", 0)
+        try:
+            return self.supervise([self.start_worker() for _ in range(self.processes)])
+        finally:
+            self.queue.clear(self.run_id)
+
+    def supervise(self, workers):
+        # a worker that dies is replaced, up to once per process
+        restarts = self.processes
+        progress = {"finished": 0, "seq": 0}
+        failed_tracks = []
+
+        def drain():
+            for item in self.queue.finished_since(self.run_id, progress["seq"]):
+                progress["seq"] = item["finished_seq"]
+                progress["finished"] += 1
+                failed_tracks.extend(self.report(item, progress["finished"]))
+
+        while True:
+            drain()
+
+            if self.is_stopped:
+                for process in workers:
+                    process.join(self.lease_time)
+                for job_id in self.job_ids:
+                    if self.store.job_tracks(job_id, UNFINISHED_STATES):
+                        self.store.set_job_status(job_id, "stopped")
+                return None
+            if not self.queue.unfinished(self.run_id):
+                # items finishing after the drain above would otherwise go unreported
+                drain()
+                break
+
+            alive = [process for process in workers if process.is_alive()]
+            for process in workers:
+                if not process.is_alive() and process.exitcode != 0 and restarts > 0:
+                    restarts -= 1
+                    self.on_progress(f"Worker {process.name} exited with {process.exitcode}, starting another", 0)
+                    alive.append(self.start_worker())
+            workers = alive
+            if not workers:
+                return False, "Every worker process exited before the downloads were done.", failed_tracks
+            time.sleep(self.poll_interval)
+
+        for process in workers:
+            process.join(self.lease_time)
+        success_message = "Download completed!"
+        if failed_tracks:
+            success_message += f"\n\nFailed downloads: {len(failed_tracks)} tracks"
+        return True, success_message, failed_tracks
+
+    def report(self, item, finished):
+        # progress line for a finished item, returns its failed_tracks entry if it failed
+        track = item["payload"]
+        percent = int(finished / self.total_tracks * 100)
+        status, error = item["state"], item["error"]
+        self.on_track(status, item, error)
+        if status == "done":
+            self.on_progress(f"Successfully downloaded: {track['title']} - {track['artists']}", percent)
+        elif status == "skipped":
+            self.on_progress(f"Skipped (File exists): {track['title']} - {track['artists']}", percent)
+        else:
+            self.on_progress(f"Failed to download: {track['title']} - {track['artists']}\nError: {error}", percent)
+            return [(track["title"], track["artists"], error)]
+        return []
+
+    def pause(self):
+        self.pause_event.set()
+
+    def resume(self):
+        self.pause_event.clear()
+
+    def stop(self):
+        # workers finish nothing new and hand their leased items back
+        self.is_stopped = True
+        self.pause_event.clear()
+        self.stop_event.set()
@@ -1,64 +1,35 @@
-from time import sleep
 from urllib.parse import urlparse, parse_qs
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import pyotp
 import base64
 from random import randrange
 from typing import Dict, Any, List, Tuple
 
+from cache import get_cache_dir
+from ratelimit import RateLimiter
+
 # https://github.com/visagenull/Spotify-Free
 def get_random_user_agent():
     return f"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_{randrange(11, 15)}_{randrange(4, 9)}) AppleWebKit/{randrange(530, 537)}.{randrange(30, 37)} (KHTML, like Gecko) Chrome/{randrange(80, 105)}.0.{randrange(3000, 4500)}.{randrange(60, 125)} Safari/{randrange(530, 537)}.{randrange(30, 36)}"
 
-def generate_totp():
-    url = "https://raw.githubusercontent.com/Thereallo1026/spotify-secrets/refs/heads/main/secrets/secretBytes.json"
-    
-    try:
-        resp = requests.get(url, timeout=10)
-        if resp.status_code != 200:
-            raise Exception(f"Failed to fetch TOTP secrets from GitHub. Status: {resp.status_code}")
-        secrets_list = resp.json()
-        
-        latest_entry = max(secrets_list, key=lambda x: x["version"])
-        version = latest_entry["version"]
-        secret_cipher = latest_entry["secret"]
-    except Exception as e:
-        raise Exception(f"Failed to fetch secrets from GitHub: {str(e)}")
-
-    processed = [byte ^ ((i % 33) + 9) for i, byte in enumerate(secret_cipher)]
-    processed_str = "".join(map(str, processed))
-    utf8_bytes = processed_str.encode('utf-8')
-    hex_str = utf8_bytes.hex()
-    secret_bytes = bytes.fromhex(hex_str)
-    b32_secret = base64.b32encode(secret_bytes).decode('utf-8')
-    totp = pyotp.TOTP(b32_secret)
-
-    headers = {
-        "Host": "open.spotify.com",
-        "User-Agent": get_random_user_agent(),
-        "Accept": "*/*",
-    }
-
-    try:
-        resp = requests.get("https://open.spotify.com/api/server-time", headers=headers, timeout=10)
-        if resp.status_code != 200:
-            raise Exception(f"Failed to get server time. Status code: {resp.status_code}")
-        data = resp.json()
-        server_time = data.get("serverTime")
-        if server_time is None:
-            raise Exception("Failed to fetch server time from Spotify")
-        return totp, server_time, version
-    except Exception as e:
-        raise Exception(f"Error getting server time: {str(e)}")
-
 token_url = 'https://open.spotify.com/api/token'
 playlist_base_url = 'https://api.spotify.com/v1/playlists/{}'
 album_base_url = 'https://api.spotify.com/v1/albums/{}'
 track_base_url = 'https://api.spotify.com/v1/tracks/{}'
 artist_base_url = 'https://api.spotify.com/v1/artists/{}'
 artist_albums_url = 'https://api.spotify.com/v1/artists/{}/albums'
+several_albums_url = 'https://api.spotify.com/v1/albums'
+several_tracks_url = 'https://api.spotify.com/v1/tracks'
+# id limits of the several albums / several tracks endpoints
+ALBUMS_PER_REQUEST = 20
+TRACKS_PER_REQUEST = 50
 headers = {
     'User-Agent': get_random_user_agent(),
     'Accept': 'application/json',
@@ -118,25 +89,172 @@ def parse_uri(uri):
 
     raise SpotifyInvalidUrlException("ERROR: unable to determine Spotify URL type or type is unsupported.")
 
-def get_json_from_api(api_url, access_token):
-    headers.update({'Authorization': 'Bearer {}'.format(access_token)})
-    
-    req = requests.get(api_url, headers=headers, timeout=10)
+def make_totp(secret_cipher):
+    processed = [byte ^ ((i % 33) + 9) for i, byte in enumerate(secret_cipher)]
+    processed_str = "".join(map(str, processed))
+    utf8_bytes = processed_str.encode('utf-8')
+    hex_str = utf8_bytes.hex()
+    secret_bytes = bytes.fromhex(hex_str)
+    b32_secret = base64.b32encode(secret_bytes).decode('utf-8')
+    return pyotp.TOTP(b32_secret)
+
+class SpotifyTokenManager:
+    """
+    Keeps the web player access token of a SpotifyClient.
+    The TOTP secrets are cached on disk for secrets_ttl seconds and the offset to Spotify's
+    clock is measured once per offset_ttl seconds, so TOTP codes are computed locally and a new
+    token costs a single request. Tokens are reused until refresh_margin seconds before they expire.
+    """
+    def __init__(self, client, cache_path=None, secrets_ttl=24 * 3600, offset_ttl=3600, refresh_margin=60):
+        self.client = client
+        self.cache_path = cache_path or os.path.join(get_cache_dir(), "spotify_secrets.json")
+        self.secrets_ttl = secrets_ttl
+        self.offset_ttl = offset_ttl
+        self.refresh_margin = refresh_margin
+        self.lock = threading.RLock()
+        self.secrets = None
+        self.secrets_fetched_at = 0
+        self.clock_offset = None
+        self.offset_measured_at = 0
+        self.token = None
+        self.token_fetched_at = 0
+        self.issued = set()
+
+    def load_secrets(self, refresh=False):
+        # return the latest (version, secret cipher), from memory, the disk cache or GitHub
+        with self.lock:
+            now = time.time()
+            if not refresh and self.secrets is None:
+                try:
+                    with open(self.cache_path, encoding='utf-8') as f:
+                        cached = json.load(f)
+                    self.secrets, self.secrets_fetched_at = cached["secrets"], cached["fetched_at"]
+                except (OSError, ValueError, KeyError):
+                    pass
+            if refresh or self.secrets is None or now - self.secrets_fetched_at > self.secrets_ttl:
+                self.secrets = self.client.fetch_totp_secrets()
+                self.secrets_fetched_at = now
+                try:
+                    with open(self.cache_path + ".tmp", "w", encoding='utf-8') as f:
+                        json.dump({"fetched_at": now, "secrets": self.secrets}, f)
+                    os.replace(self.cache_path + ".tmp", self.cache_path)
+                except OSError as e:
+                    print(f"Could not cache TOTP secrets: {e}")
+
+            latest_entry = max(self.secrets, key=lambda x: x["version"])
+            return latest_entry["version"], latest_entry["secret"]
+
+    def server_time(self):
+        # Spotify's clock in seconds, from the local clock and the last measured offset
+        with self.lock:
+            now = time.time()
+            if self.clock_offset is None or now - self.offset_measured_at > self.offset_ttl:
+                self.clock_offset = self.client.fetch_server_time() - now
+                self.offset_measured_at = now
+            return int(now + self.clock_offset)
+
+    def expires_soon(self, token):
+        expires_ms = token.get("accessTokenExpirationTimestampMs")
+        if not expires_ms:
+            # without an expiry the token is kept for half an hour
+            return time.time() - self.token_fetched_at > 1800 - self.refresh_margin
+        return (time.time() + (self.clock_offset or 0) + self.refresh_margin) * 1000 >= expires_ms
+
+    def get_token(self):
+        # return a token dict that is valid for at least refresh_margin seconds, raises on failure
+        with self.lock:
+            if self.token and not self.expires_soon(self.token):
+                return self.token
+            try:
+                token = self.client.request_access_token()
+            except Exception:
+                # the cached secrets may have been rotated, try again with fresh ones
+                self.load_secrets(refresh=True)
+                token = self.client.request_access_token()
+            self.token = token
+            self.token_fetched_at = time.time()
+            self.issued.add(token["accessToken"])
+            return token
+
+    def current(self, access_token=None):
+        # a token we handed out earlier is swapped for the current one, so long jobs survive expiry
+        with self.lock:
+            if access_token is None or access_token in self.issued:
+                return self.get_token()["accessToken"]
+            return access_token
+
+    def invalidate(self):
+        with self.lock:
+            self.token = None
+
+class SpotifyClient:
+    """
+    Spotify web api client with its own pooled keep-alive session and headers,
+    so several clients (or threads sharing one) don't step on each other.
+    Requests are paced per host by a shared RateLimiter, which backs off on 429 answers.
+    """
+    def __init__(self, pool_size=10, retries=3, rate_limit_retries=5):
+        self.pool_size = pool_size
+        self.rate_limit_retries = rate_limit_retries
+        self.limiter = RateLimiter()
+        self.session = requests.Session()
+        # connection errors and 5xx answers are retried by urllib3 with a short backoff
+        # a 429 is never retried there, get has to hand every one to the limiter
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=("GET",), raise_on_status=False, respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.headers = dict(headers)
+        self.tokens = SpotifyTokenManager(self)
 
-    if req.status_code == 429:
-        seconds = int(req.headers.get("Retry-After", "5")) + 1
-        print(f"INFO: rate limited! Sleeping for {seconds} seconds")
-        sleep(seconds)
-        return None
+    def get(self, url, headers=None, **kwargs):
+        kwargs.setdefault('timeout', 10)
+        self.limiter.acquire(url)
+        resp = self.session.get(url, headers=headers if headers is not None else self.headers, **kwargs)
+        if resp.status_code == 429:
+            seconds = self.limiter.rate_limited(url, resp.headers.get("Retry-After"))
+            print(f"INFO: rate limited! Pausing requests to {urlparse(url).netloc} for {seconds:.0f} seconds")
+        else:
+            self.limiter.success(url)
+        return resp
 
-    if req.status_code != 200:
-        raise SpotifyWebsiteParserException(f"ERROR: {api_url} gave us not a 200. Instead: {req.status_code}")
+    def fetch_totp_secrets(self):
+        url = "https://raw.githubusercontent.com/Thereallo1026/spotify-secrets/refs/heads/main/secrets/secretBytes.json"
         
-    return req.json()
+        try:
+            resp = self.get(url, headers={})
+            if resp.status_code != 200:
+                raise Exception(f"Failed to fetch TOTP secrets from GitHub. Status: {resp.status_code}")
+            return resp.json()
+        except Exception as e:
+            raise Exception(f"Failed to fetch secrets from GitHub: {str(e)}")
 
-def get_access_token():
-    try:
-        totp, server_time, totp_version = generate_totp()
+    def fetch_server_time(self):
+        time_headers = {
+            "Host": "open.spotify.com",
+            "User-Agent": get_random_user_agent(),
+            "Accept": "*/*",
+        }
+
+        try:
+            resp = self.get("https://open.spotify.com/api/server-time", headers=time_headers)
+            if resp.status_code != 200:
+                raise Exception(f"Failed to get server time. Status code: {resp.status_code}")
+            data = resp.json()
+            server_time = data.get("serverTime")
+            if server_time is None:
+                raise Exception("Failed to fetch server time from Spotify")
+            return server_time
+        except Exception as e:
+            raise Exception(f"Error getting server time: {str(e)}")
+
+    def generate_totp(self):
+        version, secret_cipher = self.tokens.load_secrets()
+        return make_totp(secret_cipher), self.tokens.server_time(), version
+
+    def request_access_token(self):
+        totp, server_time, totp_version = self.generate_totp()
         otp_code = totp.at(int(server_time))
         timestamp_ms = int(time.time() * 1000)
         
@@ -152,57 +270,134 @@ def get_access_token():
             'buildDate': '2025-07-02'
         }
         
-        req = requests.get(token_url, headers=headers, params=params, timeout=10)
+        req = self.get(token_url, params=params)
+        if req.status_code != 200:
+            raise Exception(f"Failed to get access token. Status code: {req.status_code}")
+        token = req.json()
+        if not token.get("accessToken"):
+            raise Exception("Failed to get access token. No token in response")
+        return token
+
+    def get_access_token(self):
+        try:
+            return self.tokens.get_token()
+        except Exception as e:
+            return {"error": f"Failed to get access token: {str(e)}"}
+
+    def get_json_from_api(self, api_url, access_token=None):
+        renewed = False
+        rate_limited = 0
+        while True:
+            token = self.tokens.current(access_token)
+            req = self.get(api_url, headers={**self.headers, 'Authorization': 'Bearer {}'.format(token)})
+
+            # a token of ours that was revoked early gets replaced once
+            if req.status_code == 401 and not renewed and (access_token is None or access_token in self.tokens.issued):
+                self.tokens.invalidate()
+                renewed = True
+                continue
+            # the limiter has already paused the host, so the request is simply sent again
+            if req.status_code == 429 and rate_limited < self.rate_limit_retries:
+                rate_limited += 1
+                continue
+            break
+
+        if req.status_code == 429:
+            raise SpotifyWebsiteParserException(f"ERROR: {api_url} is still rate limited after {rate_limited} retries")
+
         if req.status_code != 200:
-            return {"error": f"Failed to get access token. Status code: {req.status_code}"}
+            raise SpotifyWebsiteParserException(f"ERROR: {api_url} gave us not a 200. Instead: {req.status_code}")
+            
         return req.json()
-    except Exception as e:
-        return {"error": f"Failed to get access token: {str(e)}"}
 
-def fetch_tracks_in_batches(url: str, access_token: str, batch_size: int = 100, delay: float = 1.0) -> Tuple[List[Dict[str, Any]], int]:
-    all_tracks = []
-    current_batch = 0
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_default_client():
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = SpotifyClient()
+        return _default_client
+
+def generate_totp():
+    return get_default_client().generate_totp()
+
+def get_json_from_api(api_url, access_token=None):
+    return get_default_client().get_json_from_api(api_url, access_token)
+
+def get_access_token():
+    return get_default_client().get_access_token()
+
+def fetch_tracks_in_batches(url: str, access_token: str, batch_size: int = 100, delay: float = 1.0, client=None,
+                            first_page=None, log: bool = True) -> Tuple[List[Dict[str, Any]], int]:
+    # fetches every item of the paged endpoint url (without offset/limit)
+    # first_page: the page embedded in an album/playlist response, saves fetching it again
+    # the first page gives the total, all remaining offsets are then fetched concurrently
+    # and put back together in order
+    # delay is kept for compatibility, pacing is left to the client's rate limiter
+    client = client or get_default_client()
+    separator = '&' if '?' in url else '?'
+    page_url = lambda offset: f'{url}{separator}offset={offset}&limit={batch_size}'
     
-    while url:
-        print(f"Batch : {current_batch}")
-        
-        url_parts = url.split("offset=")
-        if len(url_parts) > 1:
-            offset_part = url_parts[1].split("&")[0]
-            print(f"Offset : {offset_part}")
-        print("-------------")
-        
-        track_data = get_json_from_api(url, access_token)
-        if not track_data:
+    if first_page is None:
+        if log:
+            print("Batch : 0")
+            print("Offset : 0")
+            print("-------------")
+        first_page = client.get_json_from_api(page_url(0), access_token)
+        if not first_page:
+            return [], 0
+    
+    all_tracks = list(first_page.get('items', []))
+    total = first_page.get('total', len(all_tracks))
+    offsets = list(range(len(all_tracks), total, batch_size))
+    
+    def fetch(batch, offset):
+        if log:
+            print(f"Batch : {batch}\nOffset : {offset}\n-------------")
+        return client.get_json_from_api(page_url(offset), access_token)
+    
+    with ThreadPoolExecutor(max_workers=max(1, client.pool_size)) as executor:
+        pages = list(executor.map(fetch, range(1, len(offsets) + 1), offsets))
+    
+    for offset, page in zip(offsets, pages):
+        # a missing page would leave a hole, so the result stops before it
+        if not page:
+            print(f"WARNING: page at offset {offset} is missing, got {len(all_tracks)} of {total} items")
             break
-        
-        items = track_data.get('items', [])
-        all_tracks.extend(items)
-        
-        url = track_data.get('next')
-        if url and "&locale=" in url:
-            url = url.split("&locale=")[0]
-            
-        if url and delay > 0:
-            sleep(delay)
-        
-        current_batch += 1
-        
-    return all_tracks, current_batch
+        all_tracks.extend(page.get('items', []))
+    
+    return all_tracks, 1 + len(offsets)
 
-def get_raw_spotify_data(spotify_url, batch: bool = False, delay: float = 1.0):
+def get_playlist_snapshot_id(spotify_url, client=None):
+    # the playlist's current snapshot_id, a single small request to tell whether it changed
+    client = client or get_default_client()
     url_info = parse_uri(spotify_url)
-    token = get_access_token()
+    if url_info['type'] != "playlist":
+        raise SpotifyInvalidUrlException(f"Not a playlist url: {spotify_url}")
+    token = client.get_access_token()
+    if "error" in token:
+        raise SpotifyWebsiteParserException(token["error"])
+    data = client.get_json_from_api(f'{playlist_base_url.format(url_info["id"])}?fields=snapshot_id',
+                                    token["accessToken"])
+    if not data or not data.get('snapshot_id'):
+        raise SpotifyWebsiteParserException("Failed to get the playlist's snapshot_id")
+    return data['snapshot_id']
+
+def get_raw_spotify_data(spotify_url, batch: bool = False, delay: float = 1.0, client=None):
+    client = client or get_default_client()
+    url_info = parse_uri(spotify_url)
+    token = client.get_access_token()
     
     if "error" in token:
         return token
     
     access_token = token["accessToken"]
     raw_data = {}
-    
     if url_info['type'] == "playlist":
         try:
-            playlist_data = get_json_from_api(
+            playlist_data = client.get_json_from_api(
                 playlist_base_url.format(url_info["id"]), 
                 access_token
             )
@@ -210,67 +405,21 @@ def get_raw_spotify_data(spotify_url, batch: bool = False, delay: float = 1.0):
                 return {"error": "Failed to get playlist data"}
                 
             raw_data = playlist_data
-            total_tracks = playlist_data.get('tracks', {}).get('total', 0)
-            
+            tracks_url = f'https://api.spotify.com/v1/playlists/{url_info["id"]}/tracks'
+            tracks, num_batches = fetch_tracks_in_batches(
+                tracks_url, access_token, 100, delay, client, first_page=playlist_data.get('tracks'), log=batch
+            )
+            raw_data['tracks']['items'] = tracks
+            raw_data['_batch_enabled'] = batch
             if batch:
-                tracks_url = f'https://api.spotify.com/v1/playlists/{url_info["id"]}/tracks?limit=100'
-                tracks, num_batches = fetch_tracks_in_batches(tracks_url, access_token, 100, delay)
-                raw_data['tracks']['items'] = tracks
                 raw_data['_batch_count'] = num_batches
-                raw_data['_batch_enabled'] = True
-                
-                if len(tracks) < total_tracks:
-                    last_offset = len(tracks)
-                    remaining_tracks = []
-                    
-                    while last_offset < total_tracks:
-                        print(f"Batch : {num_batches}")
-                        print(f"Offset : {last_offset}")
-                        print("-------------")
-                        
-                        remainder_url = f'https://api.spotify.com/v1/playlists/{url_info["id"]}/tracks?offset={last_offset}&limit=100'
-                        track_data = get_json_from_api(remainder_url, access_token)
-                        
-                        if not track_data or not track_data.get('items'):
-                            break
-                            
-                        items = track_data.get('items', [])
-                        remaining_tracks.extend(items)
-                        
-                        if len(items) < 100:
-                            break
-                            
-                        last_offset += len(items)
-                        num_batches += 1
-                        
-                        if delay > 0:
-                            sleep(delay)
-                    
-                    tracks.extend(remaining_tracks)
-                    raw_data['tracks']['items'] = tracks
-                    raw_data['_batch_count'] = num_batches
-            else:
-                tracks = []
-                tracks_url = f'https://api.spotify.com/v1/playlists/{url_info["id"]}/tracks?limit=100'
-                while tracks_url:
-                    track_data = get_json_from_api(tracks_url, access_token)
-                    if not track_data:
-                        break
-                        
-                    tracks.extend(track_data['items'])
-                    tracks_url = track_data.get('next')
-                    if tracks_url and "&locale=" in tracks_url:
-                        tracks_url = tracks_url.split("&locale=")[0]
-                    
-                raw_data['tracks']['items'] = tracks
-                raw_data['_batch_enabled'] = False
                 
         except Exception as e:
             return {"error": f"Failed to get playlist data: {str(e)}"}
             
     elif url_info["type"] == "album":
         try:
-            album_data = get_json_from_api(
+            album_data = client.get_json_from_api(
                 album_base_url.format(url_info["id"]),
                 access_token
             )
@@ -279,67 +428,21 @@ def get_raw_spotify_data(spotify_url, batch: bool = False, delay: float = 1.0):
                 
             album_data['_token'] = access_token
             raw_data = album_data
-            total_tracks = album_data.get('total_tracks', 0)
-            
+            tracks_url = f'{album_base_url.format(url_info["id"])}/tracks'
+            tracks, num_batches = fetch_tracks_in_batches(
+                tracks_url, access_token, 50, delay, client, first_page=album_data.get('tracks'), log=batch
+            )
+            raw_data['tracks']['items'] = tracks
+            raw_data['_batch_enabled'] = batch
             if batch:
-                tracks_url = f'{album_base_url.format(url_info["id"])}/tracks?limit=50'
-                tracks, num_batches = fetch_tracks_in_batches(tracks_url, access_token, 50, delay)
-                raw_data['tracks']['items'] = tracks
                 raw_data['_batch_count'] = num_batches
-                raw_data['_batch_enabled'] = True
-                
-                if len(tracks) < total_tracks:
-                    last_offset = len(tracks)
-                    remaining_tracks = []
-                    
-                    while last_offset < total_tracks:
-                        print(f"Batch : {num_batches}")
-                        print(f"Offset : {last_offset}")
-                        print("-------------")
-                        
-                        remainder_url = f'{album_base_url.format(url_info["id"])}/tracks?offset={last_offset}&limit=50'
-                        track_data = get_json_from_api(remainder_url, access_token)
-                        
-                        if not track_data or not track_data.get('items'):
-                            break
-                            
-                        items = track_data.get('items', [])
-                        remaining_tracks.extend(items)
-                        
-                        if len(items) < 50:
-                            break
-                            
-                        last_offset += len(items)
-                        num_batches += 1
-                        
-                        if delay > 0:
-                            sleep(delay)
-                    
-                    tracks.extend(remaining_tracks)
-                    raw_data['tracks']['items'] = tracks
-                    raw_data['_batch_count'] = num_batches
-            else:
-                tracks = []
-                tracks_url = f'{album_base_url.format(url_info["id"])}/tracks?limit=50'
-                while tracks_url:
-                    track_data = get_json_from_api(tracks_url, access_token)
-                    if not track_data:
-                        break
-                        
-                    tracks.extend(track_data['items'])
-                    tracks_url = track_data.get('next')
-                    if tracks_url and "&locale=" in tracks_url:
-                        tracks_url = tracks_url.split("&locale=")[0]
-                    
-                raw_data['tracks']['items'] = tracks
-                raw_data['_batch_enabled'] = False
                 
         except Exception as e:
             return {"error": f"Failed to get album data: {str(e)}"}
                 
     elif url_info["type"] == "track":
         try:
-            track_data = get_json_from_api(
+            track_data = client.get_json_from_api(
                 track_base_url.format(url_info["id"]),
                 access_token
             )
@@ -352,7 +455,7 @@ def get_raw_spotify_data(spotify_url, batch: bool = False, delay: float = 1.0):
             
     elif url_info["type"] == "artist_discography":
         try:
-            artist_data = get_json_from_api(
+            artist_data = client.get_json_from_api(
                 artist_base_url.format(url_info["id"]),
                 access_token
             )
@@ -365,35 +468,16 @@ def get_raw_spotify_data(spotify_url, batch: bool = False, delay: float = 1.0):
             else:
                 include_groups = discography_type
             
-            albums = []
-            albums_url = f'{artist_albums_url.format(url_info["id"])}?include_groups={include_groups}&limit=50'
-            
+            albums_url = f'{artist_albums_url.format(url_info["id"])}?include_groups={include_groups}'
+            albums, num_batches = fetch_tracks_in_batches(albums_url, access_token, 50, delay, client, log=batch)
+            raw_data = {
+                "artist_info": artist_data,
+                "albums": albums,
+                "discography_type": discography_type,
+                "_batch_enabled": batch
+            }
             if batch:
-                albums, num_batches = fetch_tracks_in_batches(albums_url, access_token, 50, delay)
-                raw_data = {
-                    "artist_info": artist_data,
-                    "albums": albums,
-                    "discography_type": discography_type,
-                    "_batch_count": num_batches,
-                    "_batch_enabled": True
-                }
-            else:
-                while albums_url:
-                    album_data = get_json_from_api(albums_url, access_token)
-                    if not album_data:
-                        break
-                        
-                    albums.extend(album_data['items'])
-                    albums_url = album_data.get('next')
-                    if albums_url and "&locale=" in albums_url:
-                        albums_url = albums_url.split("&locale=")[0]
-                
-                raw_data = {
-                    "artist_info": artist_data,
-                    "albums": albums,
-                    "discography_type": discography_type,
-                    "_batch_enabled": False
-                }
+                raw_data['_batch_count'] = num_batches
                 
             raw_data['_token'] = access_token
             
@@ -402,7 +486,7 @@ def get_raw_spotify_data(spotify_url, batch: bool = False, delay: float = 1.0):
             
     elif url_info["type"] == "artist":
         try:
-            artist_data = get_json_from_api(
+            artist_data = client.get_json_from_api(
                 artist_base_url.format(url_info["id"]),
                 access_token
             )
@@ -507,6 +591,7 @@ def format_playlist_data(playlist_data):
         })
     
     playlist_info = {
+        "snapshot_id": playlist_data.get('snapshot_id', ''),
         "tracks": {"total": playlist_data.get('tracks', {}).get('total', 0)},
         "followers": {"total": playlist_data.get('followers', {}).get('total', 0)},
         "owner": {
@@ -524,7 +609,60 @@ def format_playlist_data(playlist_data):
         "track_list": track_list
     }
 
-def format_artist_discography_data(discography_data):
+def fetch_album_tracks(album_ids, access_token, client=None):
+    # returns album id -> simplified tracks, fetched through the several albums endpoint
+    client = client or get_default_client()
+    album_tracks = {}
+    
+    for start in range(0, len(album_ids), ALBUMS_PER_REQUEST):
+        ids = album_ids[start:start + ALBUMS_PER_REQUEST]
+        try:
+            albums_data = client.get_json_from_api(f'{several_albums_url}?ids={",".join(ids)}', access_token)
+            if not albums_data:
+                continue
+            
+            for album in albums_data.get('albums', []):
+                if not album:
+                    continue
+                # only the first page of tracks is embedded in the album
+                tracks = list(album.get('tracks', {}).get('items', []))
+                tracks_url = album.get('tracks', {}).get('next')
+                while tracks_url:
+                    if "&locale=" in tracks_url:
+                        tracks_url = tracks_url.split("&locale=")[0]
+                    track_data = client.get_json_from_api(tracks_url, access_token)
+                    if not track_data:
+                        break
+                    tracks.extend(track_data['items'])
+                    tracks_url = track_data.get('next')
+                album_tracks[album['id']] = tracks
+        except Exception as e:
+            print(f"Error getting albums {','.join(ids)}: {str(e)}")
+    
+    return album_tracks
+
+def fetch_track_isrcs(track_ids, access_token, client=None):
+    # returns track id -> ISRC, fetched through the several tracks endpoint
+    client = client or get_default_client()
+    isrcs = {}
+    
+    for start in range(0, len(track_ids), TRACKS_PER_REQUEST):
+        ids = track_ids[start:start + TRACKS_PER_REQUEST]
+        try:
+            tracks_data = client.get_json_from_api(f'{several_tracks_url}?ids={",".join(ids)}', access_token)
+            if not tracks_data:
+                continue
+            
+            for track in tracks_data.get('tracks', []):
+                if track:
+                    isrcs[track['id']] = track.get('external_ids', {}).get('isrc', '')
+        except Exception as e:
+            print(f"Error getting ISRCs for tracks {','.join(ids)}: {str(e)}")
+    
+    return isrcs
+
+def format_artist_discography_data(discography_data, client=None):
+    client = client or get_default_client()
     artist_info = discography_data.get('artist_info', {})
     albums = discography_data.get('albums', [])
     access_token = discography_data.get('_token', '')
@@ -548,6 +686,15 @@ def format_artist_discography_data(discography_data):
     
     album_list = []
     all_tracks = []
+    album_tracks = {}
+    track_isrcs = {}
+    
+    if access_token:
+        album_tracks = fetch_album_tracks([album['id'] for album in albums if album.get('id')], access_token, client)
+        track_isrcs = fetch_track_isrcs(
+            [track['id'] for tracks in album_tracks.values() for track in tracks if track.get('id')],
+            access_token, client
+        )
     
     for album in albums:
         album_image = ''
@@ -571,57 +718,29 @@ def format_artist_discography_data(discography_data):
         album_list.append(album_info)
         
         if access_token and album.get('id'):
-            try:
-                tracks = []
-                tracks_url = f'{album_base_url.format(album.get("id"))}/tracks?limit=50'
+            if album['id'] not in album_tracks:
+                print(f"Error getting tracks for album {album.get('name', '')}")
+                continue
+
+            for track in album_tracks[album['id']]:
+                track_artists = []
+                for artist in track.get('artists', []):
+                    track_artists.append(artist['name'])
                 
-                while tracks_url:
-                    track_data = get_json_from_api(tracks_url, access_token)
-                    if not track_data:
-                        break
-                        
-                    tracks.extend(track_data['items'])
-                    tracks_url = track_data.get('next')
-                    if tracks_url and "&locale=" in tracks_url:
-                        tracks_url = tracks_url.split("&locale=")[0]
+                formatted_track = {
+                    "artists": ", ".join(track_artists),
+                    "name": track.get('name', ''),
+                    "album_name": album.get('name', ''),
+                    "album_type": album.get('album_type', ''),
+                    "duration_ms": track.get('duration_ms', 0),
+                    "images": album_image,
+                    "release_date": album.get('release_date', ''),
+                    "track_number": track.get('track_number', 0),
+                    "external_urls": track.get('external_urls', {}).get('spotify', ''),
+                    "isrc": track_isrcs.get(track.get('id', ''), '')
+                }
                 
-                for track in tracks:
-                    track_artists = []
-                    for artist in track.get('artists', []):
-                        track_artists.append(artist['name'])
-                    
-                    track_id = track.get('id', '')
-                    track_isrc = ''
-                    
-                    if track_id:
-                        try:
-                            full_track_data = get_json_from_api(
-                                track_base_url.format(track_id),
-                                access_token
-                            )
-                            if full_track_data:
-                                track_isrc = full_track_data.get('external_ids', {}).get('isrc', '')
-                        except:
-                            pass
-                    
-                    formatted_track = {
-                        "artists": ", ".join(track_artists),
-                        "name": track.get('name', ''),
-                        "album_name": album.get('name', ''),
-                        "album_type": album.get('album_type', ''),
-                        "duration_ms": track.get('duration_ms', 0),
-                        "images": album_image,
-                        "release_date": album.get('release_date', ''),
-                        "track_number": track.get('track_number', 0),
-                        "external_urls": track.get('external_urls', {}).get('spotify', ''),
-                        "isrc": track_isrc
-                    }
-                    
-                    all_tracks.append(formatted_track)
-                    
-            except Exception as e:
-                print(f"Error getting tracks for album {album.get('name', '')}: {str(e)}")
-                continue
+                all_tracks.append(formatted_track)
     
     return {
         "artist_info": formatted_artist_info,
@@ -645,7 +764,7 @@ def format_artist_data(artist_data):
         }
     }
 
-def process_spotify_data(raw_data, data_type):
+def process_spotify_data(raw_data, data_type, client=None):
     if not raw_data or "error" in raw_data:
         return {"error": "Invalid data provided"}
         
@@ -657,7 +776,7 @@ def process_spotify_data(raw_data, data_type):
         elif data_type == "playlist":
             return format_playlist_data(raw_data)
         elif data_type == "artist_discography":
-            return format_artist_discography_data(raw_data)
+            return format_artist_discography_data(raw_data, client)
         elif data_type == "artist":
             return format_artist_data(raw_data)
         else:
@@ -665,11 +784,11 @@ def process_spotify_data(raw_data, data_type):
     except Exception as e:
         return {"error": f"Error processing data: {str(e)}"}
 
-def get_filtered_data(spotify_url, batch=False, delay=1.0):
-    raw_data = get_raw_spotify_data(spotify_url, batch=batch, delay=delay)
+def get_filtered_data(spotify_url, batch=False, delay=1.0, client=None):
+    raw_data = get_raw_spotify_data(spotify_url, batch=batch, delay=delay, client=client)
     if raw_data and "error" not in raw_data:
         url_info = parse_uri(spotify_url)
-        filtered_data = process_spotify_data(raw_data, url_info['type'])
+        filtered_data = process_spotify_data(raw_data, url_info['type'], client)
         return filtered_data
     return {"error": "Failed to get raw data"}
 
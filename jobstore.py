@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import get_data_dir
+
+# states of a job's tracks
+PENDING = "pending"
+RESOLVED = "resolved"
+TRANSFERRING = "transferring"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# tracks a resumed job still has to work on, a transfer cut off by a crash resumes from its .part journal
+UNFINISHED_STATES = (PENDING, RESOLVED, TRANSFERRING)
+
+
+class JobStore:
+    """
+    On-disk record of download jobs: each job's url, output folder and options, and every track
+    with its state, so an interrupted job resumes where it stopped and failed tracks can be rerun
+    without walking the whole job again.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_data_dir(), "jobs.sqlite3")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " url TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " outpath TEXT NOT NULL,"
+                " options TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                " job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,"
+                " idx INTEGER NOT NULL,"
+                " isrc TEXT, title TEXT, artists TEXT, album TEXT,"
+                " track_number INTEGER, duration_ms INTEGER, release_date TEXT,"
+                " state TEXT NOT NULL,"
+                " error TEXT,"
+                " path TEXT,"
+                " deezer_id TEXT,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (job_id, idx))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS tracks_state ON tracks (job_id, state)")
+
+    def create_job(self, url, name, outpath, options, tracks):
+        # record a new job with all its tracks pending, returns the job id
+        now = time.time()
+        with self.lock, self.conn:
+            job_id = self.conn.execute(
+                "INSERT INTO jobs (url, name, outpath, options, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                (url, name, outpath, json.dumps(options), now, now)
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO tracks (job_id, idx, isrc, title, artists, album, track_number, duration_ms,"
+                " release_date, state, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, index, track.id, track.title, track.artists, track.album, track.track_number,
+                  track.duration_ms, track.release_date, PENDING, now) for index, track in enumerate(tracks)]
+            )
+        return job_id
+
+    def set_track_state(self, job_id, index, state, error=None, path=None, deezer_id=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE tracks SET state = ?, error = ?, path = COALESCE(?, path),"
+                " deezer_id = COALESCE(?, deezer_id), updated_at = ? WHERE job_id = ? AND idx = ?",
+                (state, error, path or None, None if deezer_id is None else str(deezer_id), time.time(), job_id, index)
+            )
+
+    def set_job_status(self, job_id, status):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def reset_tracks(self, job_id, states=(FAILED,)):
+        # put the tracks in states back to pending, e.g. to rerun only the failed ones
+        # returns how many tracks were reset
+        with self.lock, self.conn:
+            count = self.conn.execute(
+                f"UPDATE tracks SET state = ?, error = NULL, updated_at = ? WHERE job_id = ?"
+                f" AND state IN ({','.join('?' * len(states))})",
+                (PENDING, time.time(), job_id, *states)
+            ).rowcount
+            if count:
+                self.conn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), job_id))
+        return count
+
+    def get_job(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def job_tracks(self, job_id, states=None):
+        # the job's track rows as dicts in track order, only tracks in states if given
+        query = "SELECT * FROM tracks WHERE job_id = ?"
+        params = [job_id]
+        if states:
+            query += f" AND state IN ({','.join('?' * len(states))})"
+            params.extend(states)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY idx", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def jobs(self, states=None, limit=50):
+        # most recent jobs first, each with a count of its tracks per state
+        # states: only jobs that have tracks in one of these states
+        query = "SELECT * FROM jobs"
+        params = []
+        if states:
+            query += (f" WHERE id IN (SELECT job_id FROM tracks WHERE state IN ({','.join('?' * len(states))}))")
+            params.extend(states)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY id DESC LIMIT ?", (*params, limit)).fetchall()
+            jobs = [self._job(row) for row in rows]
+            for job in jobs:
+                job["counts"] = dict(self.conn.execute(
+                    "SELECT state, COUNT(*) FROM tracks WHERE job_id = ? GROUP BY state", (job["id"],)
+                ).fetchall())
+        return jobs
+
+    def unfinished_jobs(self):
+        return self.jobs(UNFINISHED_STATES)
+
+    def _job(self, row):
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
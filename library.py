@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from cache import get_cache_dir
+from deezer import read_id3_text
+
+# files that can carry the ID3 tag writeid3v2 writes
+AUDIO_EXTENSIONS = (".mp3", ".flac")
+
+
+def _under(root):
+    # SQL condition and parameters for the paths under root
+    prefix = os.path.join(os.path.abspath(root), "")
+    return "substr(path, 1, ?) = ?", (len(prefix), prefix)
+
+
+class LibraryIndex:
+    """
+    Index of the downloaded files by the ISRC in their TSRC frame, so a track is recognised
+    whatever its file is called and wherever it was put under the output folder.
+    scan only reads the tags of files that are new or changed since the last scan.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache_dir(), "library.sqlite3")
+        self.lock = threading.Lock()
+        self.scanned = set()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY,"
+                " isrc TEXT,"
+                " mtime REAL NOT NULL,"
+                " size INTEGER NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_isrc ON files (isrc)")
+
+    def scan(self, root, force=False):
+        # bring the index of the files under root up to date, once per root unless force
+        # returns how many files had their tags read
+        root = os.path.abspath(root)
+        if root in self.scanned and not force:
+            return 0
+        condition, params = _under(root)
+        with self.lock:
+            known = {path: (mtime, size) for path, mtime, size in self.conn.execute(
+                f"SELECT path, mtime, size FROM files WHERE {condition}", params)}
+
+        seen = set()
+        changed = []
+        for folder, _, names in os.walk(root):
+            for name in names:
+                # partial downloads end in .part and have no final tag yet
+                if not name.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                if known.get(path) != (stat.st_mtime, stat.st_size):
+                    changed.append((path, self._read_isrc(path), stat.st_mtime, stat.st_size))
+
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files (path, isrc, mtime, size) VALUES (?, ?, ?, ?)",
+                                  changed)
+            self.conn.executemany("DELETE FROM files WHERE path = ?",
+                                  [(path,) for path in known if path not in seen])
+        self.scanned.add(root)
+        return len(changed)
+
+    def _read_isrc(self, path):
+        try:
+            with open(path, "rb") as f:
+                isrc = read_id3_text(f, "TSRC")
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Could not read the tags of {path}: {e}")
+            return None
+        return isrc.strip().upper() if isrc else None
+
+    def find(self, isrc, root):
+        # path of a file with isrc under root, None if there is none
+        if not isrc:
+            return None
+        condition, params = _under(root)
+        with self.lock:
+            paths = [path for (path,) in self.conn.execute(
+                f"SELECT path FROM files WHERE isrc = ? AND {condition}", (isrc.upper(), *params))]
+        for path in paths:
+            if os.path.exists(path):
+                return path
+            with self.lock, self.conn:
+                self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        return None
+
+    def add(self, path, isrc):
+        # record a file that was just downloaded
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            mtime, size = stat.st_mtime, stat.st_size
+        except OSError:
+            mtime, size = time.time(), 0
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO files (path, isrc, mtime, size) VALUES (?, ?, ?, ?)",
+                              (path, isrc.upper() if isrc else None, mtime, size))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
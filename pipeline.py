@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+
+# marks the end of the input for a stage's workers
+_DONE = object()
+
+
+class PipelineStage:
+    """ one step of a Pipeline, run by its own pool of worker threads """
+    def __init__(self, name, func, workers=1, queue_size=16, batch_size=1, batch_wait=0.5):
+        # func(item) returns the item handed to the next stage
+        # with batch_size > 1, func(items) gets up to batch_size queued items at once and returns
+        # one result per item, an Exception in place of a result fails just that item
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait = batch_wait
+        self.processed = 0
+        self.started_at = None
+        self.lock = threading.Lock()
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def throughput(self):
+        # items per second since the stage picked up its first item
+        with self.lock:
+            if not self.started_at or not self.processed:
+                return 0.0
+            elapsed = time.monotonic() - self.started_at
+            return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "queue": self.depth(),
+            "processed": self.processed,
+            "throughput": self.throughput(),
+        }
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages connected by bounded queues.
+    A stage that raises drops the item and reports it through on_error;
+    items that make it through every stage are passed to on_done.
+    """
+    def __init__(self, stages, on_done=None, on_error=None, should_stop=None,
+                 wait_if_paused=None, on_stats=None, stats_interval=10.0):
+        self.stages = stages
+        self.on_done = on_done or (lambda item: None)
+        self.on_error = on_error or (lambda item, error: None)
+        self.should_stop = should_stop or (lambda: False)
+        self.wait_if_paused = wait_if_paused or (lambda: not self.should_stop())
+        self.on_stats = on_stats
+        self.stats_interval = stats_interval
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages]
+
+    def run(self, items):
+        finished = threading.Event()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(stage, next_stage, remaining),
+                                          name=f"pipeline-{stage.name}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        if self.on_stats:
+            reporter = threading.Thread(target=self._report, args=(finished,), daemon=True)
+            reporter.start()
+
+        first = self.stages[0]
+        for item in items:
+            if self.should_stop():
+                break
+            first.queue.put(item)
+        for _ in range(first.workers):
+            first.queue.put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        finished.set()
+
+    def _work(self, stage, next_stage, remaining):
+        try:
+            self._work_items(stage, next_stage)
+        finally:
+            # the last worker out of a stage closes the next one, even if this one died
+            with stage.lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and next_stage is not None:
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(_DONE)
+
+    def _work_items(self, stage, next_stage):
+        done = False
+        while not done:
+            item = stage.queue.get()
+            if item is _DONE:
+                break
+            batch, done = self._collect_batch(stage, [item])
+
+            # after a stop the queues are only drained, so upstream puts never block forever
+            if not self.wait_if_paused():
+                continue
+
+            with stage.lock:
+                if stage.started_at is None:
+                    stage.started_at = time.monotonic()
+            try:
+                results = self._process(stage, batch)
+            finally:
+                with stage.lock:
+                    stage.processed += len(batch)
+
+            for item, result in zip(batch, results):
+                self._hand_on(item, result, next_stage)
+
+    def _hand_on(self, item, result, next_stage):
+        # a callback that raises (e.g. a locked database) fails the item, not the worker
+        try:
+            if isinstance(result, Exception):
+                self.on_error(item, result)
+            elif next_stage is None:
+                self.on_done(result)
+            else:
+                next_stage.queue.put(result)
+            return
+        except Exception as e:
+            error = e
+        print(f"Pipeline stage callback failed: {error}")
+        if isinstance(result, Exception):
+            return
+        try:
+            self.on_error(item, error)
+        except Exception as e:
+            print(f"Pipeline error callback failed: {e}")
+
+    def _collect_batch(self, stage, batch):
+        # wait up to batch_wait for more items, returns (batch, end of input reached)
+        deadline = time.monotonic() + stage.batch_wait
+        while len(batch) < stage.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = stage.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _process(self, stage, batch):
+        if stage.batch_size == 1:
+            try:
+                return [stage.func(batch[0])]
+            except Exception as e:
+                return [e]
+        try:
+            return stage.func(batch)
+        except Exception as e:
+            return [e] * len(batch)
+
+    def _report(self, finished):
+        while not finished.wait(self.stats_interval):
+            self.on_stats(self.stats())
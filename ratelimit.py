@@ -0,0 +1,93 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+def parse_retry_after(value, default=5.0):
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate adapts to the server: every answer that isn't a 429 raises it
+    a little, up to max_rate, every 429 halves it and pauses the bucket for the Retry-After time.
+    """
+    def __init__(self, rate=10.0, burst=10, min_rate=0.5, max_rate=50.0, increase=0.2):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        # block until a request may be sent
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.paused_until > now:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def rate_limited(self, retry_after):
+        # returns how long requests are paused for
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + retry_after)
+            return self.paused_until - now
+
+
+class RateLimiter:
+    """ one TokenBucket per host, shared by every thread using the same client """
+    def __init__(self, **bucket_options):
+        self.bucket_options = bucket_options
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(**self.bucket_options)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    def success(self, url):
+        self.bucket(url).success()
+
+    def rate_limited(self, url, retry_after=None):
+        # retry_after is the raw Retry-After header, one extra second is added as a margin
+        return self.bucket(url).rate_limited(parse_retry_after(retry_after) + 1)
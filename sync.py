@@ -0,0 +1,82 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import get_data_dir
+from getMetadata import get_filtered_data, get_playlist_snapshot_id, parse_uri
+
+
+class PlaylistSync:
+    """
+    Remembers the snapshot_id and the tracks of every synced playlist.
+    changes() only fetches a playlist's tracks when its snapshot_id moved, and then tells which
+    ISRCs were added and removed since the last save().
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_data_dir(), "sync.sqlite3")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS playlists ("
+                " playlist_id TEXT PRIMARY KEY,"
+                " url TEXT NOT NULL,"
+                " name TEXT,"
+                " snapshot_id TEXT NOT NULL,"
+                " tracks TEXT NOT NULL,"
+                " synced_at REAL NOT NULL)"
+            )
+
+    def get(self, playlist_id):
+        # (snapshot_id, {isrc: track}) of the last sync, None if the playlist was never synced
+        with self.lock:
+            row = self.conn.execute("SELECT snapshot_id, tracks FROM playlists WHERE playlist_id = ?",
+                                    (playlist_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def changes(self, url, client=None):
+        # None if the playlist is unchanged since the last save, otherwise a dict with its
+        # metadata (get_filtered_data's result) and the added and removed tracks, keyed by ISRC
+        # tracks without an ISRC can't be told apart and are left out
+        playlist_id = parse_uri(url)["id"]
+        snapshot_id = get_playlist_snapshot_id(url, client)
+        previous = self.get(playlist_id)
+        if previous and previous[0] == snapshot_id:
+            return None
+
+        metadata = get_filtered_data(url, client=client)
+        if "error" in metadata:
+            raise ValueError(metadata["error"])
+        tracks = {}
+        for track in metadata["track_list"]:
+            if track.get("isrc"):
+                tracks.setdefault(track["isrc"], {"title": track["name"], "artists": track["artists"]})
+        old_tracks = previous[1] if previous else {}
+        return {
+            "url": url,
+            "playlist_id": playlist_id,
+            # the listing may have moved on since the snapshot_id request, keep the one it came with
+            "snapshot_id": metadata["playlist_info"].get("snapshot_id") or snapshot_id,
+            "name": metadata["playlist_info"]["owner"]["name"],
+            "metadata": metadata,
+            "tracks": tracks,
+            "added": {isrc: track for isrc, track in tracks.items() if isrc not in old_tracks},
+            "removed": {isrc: track for isrc, track in old_tracks.items() if isrc not in tracks},
+        }
+
+    def save(self, change):
+        # record a change returned by changes() as synced, once its added tracks are downloaded
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO playlists (playlist_id, url, name, snapshot_id, tracks, synced_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (change["playlist_id"], change["url"], change["name"], change["snapshot_id"],
+                 json.dumps(change["tracks"]), time.time())
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()